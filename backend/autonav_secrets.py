@@ -4,4 +4,47 @@ MYSQL_HOST = "" #OBFUSCATED
 MYSQL_DB = "" #OBFUSCATED
 JWT_SECRET = "" #OBFUSCATED
 JWT_ALGORITHM = "HS256"
-JWT_TOKEN_EXPIRE_MINUTES = 15
\ No newline at end of file
+JWT_TOKEN_EXPIRE_MINUTES = 15
+DEVICE_TOKEN_SECRET = "" #OBFUSCATED
+DEVICE_TOKENS_REQUIRED = False # position ingest requires a device token bound to the tag; see Device Tokens in the README before enabling
+DEVICE_REVOCATION_REFRESH_SECONDS = 30
+TAG_FLUSH_INTERVAL_SECONDS = 1.0
+INGEST_MOVE_EPSILON = 5.0 # fixes closer than this to the last stored position only refresh last_contact; 0 stores every fix
+INGEST_HEARTBEAT_SECONDS = 10.0 # a position is stored at least this often while a tag reports
+PRESENCE_STALE_SECONDS = 5.0 # tags are stale this long after their last contact
+PRESENCE_OFFLINE_SECONDS = 60.0 # and offline this long after it
+PRESENCE_TICK_SECONDS = 0.5
+CHANGE_FEED_SIZE = 65536 # tag changes kept for GET /tags/changes
+STREAM_MAX_RATE_HZ = 10
+STREAM_MAX_PENDING = 1024
+HISTORY_FLUSH_INTERVAL_SECONDS = 1.0
+HISTORY_FLUSH_MAX_ATTEMPTS = 60 # failed flushes in a row before buffered history is dropped
+HISTORY_MAX_POINTS = 10000
+PRINCIPAL_CACHE_SIZE = 1024
+PRINCIPAL_CACHE_TTL_SECONDS = 30
+PASSWORD_HASH_WORKERS = 2
+DB_POOL_SIZE = 10
+DB_POOL_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT_SECONDS = 30
+DB_POOL_PRE_PING = True
+DB_POOL_WARM_CONNECTIONS = 4 # opened on startup, at most DB_POOL_SIZE
+INGEST_UDP_HOST = "0.0.0.0"
+INGEST_UDP_PORT = None # e.g. 9750 to accept binary position datagrams
+SPATIAL_CELL_SIZE = 250 # map units per spatial index cell
+SPATIAL_COORDINATE_LIMIT = 1000000 # spatial queries reject coordinates and radii beyond this
+GEOFENCE_FLUSH_INTERVAL_SECONDS = 1.0
+PAGE_MAX_LIMIT = 1000
+BULK_MAX_ROWS = 10000
+FAST_SERIALIZATION = False # encode /tags/all and /anchors/all without per-row pydantic models, same output
+TAGS_ALL_CACHE_SECONDS = 0 # /tags/all body reused by every request for this long, e.g. 0.1; 0 disables
+RANGE_CALIBRATION_OFFSET = 42.36565 # calibrated = (raw - offset) / scale
+RANGE_CALIBRATION_SCALE = 1.46323
+RANGE_MIN = 0 # raw ranges outside (RANGE_MIN, RANGE_MAX) are dropped
+RANGE_MAX = 2000
+RANGE_MAX_ANCHORS = 4 # nearest anchors used per solve
+RANGES_TICK_SECONDS = 0.01
+MAP_TILE_DIRECTORY = "map_tiles"
+MAP_TILE_SIZE = 256
+MAP_OPEN_ARCHIVES = 16 # tile archives kept memory-mapped
+MAP_MAX_IMAGE_BYTES = 50 * 1024 * 1024
+ROUTE_CACHE_SOURCES = 512 # shortest path trees kept by the route planner
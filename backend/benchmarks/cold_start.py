@@ -0,0 +1,98 @@
+# Measures the cold start of a backend worker.
+#
+# Migrates a throwaway SQLite database seeded with --tags tags and
+# --waypoints waypoints, then starts --runs fresh interpreters that each
+# import main and run the startup half of the lifespan (pool warm-up, tag
+# store, spatial indexes, zones), as a new uvicorn worker would. Reports the
+# import, startup and whole-process times (median and max over the runs),
+# tagged with the current git commit.
+#
+# Run from the backend directory (requires aiosqlite):
+#     python -m benchmarks.cold_start --runs 10
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from benchmarks.common import create_tables, git_commit, use_database
+
+async def seed(args):
+    import database
+    import models
+
+    await create_tables()
+
+    async with database.SessionLocal() as db:
+        db.add_all(models.Tag(id=uuid.uuid4(), name=f"tag-{i}", address=f"C0:1D:00:00:{i >> 8 & 255:02X}:{i & 255:02X}") for i in range(args.tags))
+        db.add_all(
+            models.Waypoint(id=uuid.uuid4(), name=f"waypoint-{i}", pos_x=random.uniform(0, 7000), pos_y=random.uniform(0, 5500))
+            for i in range(args.waypoints)
+        )
+        await db.commit()
+
+    await database.dispose()
+
+async def child() -> dict:
+    # Runs in the fresh interpreter
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+
+    return {"import_s": imported - started, "startup_s": ready - imported}
+
+def summary(samples: list) -> dict:
+    return {"median_s": round(statistics.median(samples), 4), "max_s": round(max(samples), 4)}
+
+def run(args) -> dict:
+    asyncio.run(seed(args))
+
+    runs = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.cold_start", "--child"],
+            capture_output=True, text=True, check=True, env=os.environ
+        )
+        total = time.perf_counter() - started
+
+        # The last line is the child's report; the worker logs come before it
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        measured["process_s"] = total
+        runs.append(measured)
+
+    return {
+        "benchmark": "cold_start",
+        "commit": git_commit(),
+        "parameters": vars(args),
+        "import": summary([r["import_s"] for r in runs]),
+        "startup": summary([r["startup_s"] for r in runs]),
+        "process": summary([r["process_s"] for r in runs])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of a backend worker")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh worker processes to start")
+    parser.add_argument("--tags", type=int, default=500, help="Tags to seed")
+    parser.add_argument("--waypoints", type=int, default=500, help="Waypoints to seed")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child())))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(directory)
+        print(json.dumps(run(args), indent=2))
+
+if __name__ == "__main__":
+    main()
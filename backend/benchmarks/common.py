@@ -0,0 +1,36 @@
+# Helpers shared by the benchmarks. Modules of the application are imported
+# lazily, after use_database() has pointed AUTONAV_DATABASE_URL at the
+# throwaway SQLite file.
+import os
+import statistics
+import subprocess
+
+def use_database(directory: str) -> str:
+    url = "sqlite+aiosqlite:///" + os.path.join(directory, "benchmark.db")
+    os.environ["AUTONAV_DATABASE_URL"] = url
+    return url
+
+async def create_tables():
+    import migrate
+
+    await migrate.upgrade()
+
+def percentiles(samples: list) -> dict:
+    if len(samples) < 2:
+        return {"count": len(samples)}
+
+    # Inclusive: percentiles stay within the observed samples
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "count": len(samples),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(samples), 3)
+    }
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
@@ -0,0 +1,219 @@
+# API load test with a synthetic tag fleet.
+#
+# Boots main.app under uvicorn on a local port, in its own thread and event
+# loop, against a throwaway SQLite database seeded with --tags tags (each
+# with a device credential), --anchors anchors and --waypoints waypoints.
+# Then --fleet of those tags post positions to /position at --rate Hz each,
+# authenticated with their device tokens, while --dashboards clients
+# poll /tags/all every --poll-interval seconds, for --duration seconds.
+#
+# Prints (or writes to --output) a JSON report with throughput, error count
+# and p50/p95/p99 latency per route, tagged with the current git commit so
+# runs can be compared between commits.
+#
+# Run from the backend directory (requires httpx, uvicorn and aiosqlite):
+#     python -m benchmarks.loadtest --tags 50 --fleet 30 --rate 10 --dashboards 20
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import json
+import math
+import platform
+import random
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from benchmarks.common import create_tables, git_commit, percentiles, use_database
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route: str, started: float, ok: bool):
+        self.latencies.setdefault(route, []).append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, duration: float) -> dict:
+        return {
+            route: {
+                "throughput_rps": round(len(samples) / duration, 2),
+                "errors": self.errors.get(route, 0),
+                **percentiles(samples)
+            }
+            for route, samples in sorted(self.latencies.items())
+        }
+
+#@@@@@ Setup
+async def seed(args) -> tuple:
+    import database
+    import device_auth
+    import models
+    from routers import auth
+
+    await create_tables()
+
+    addresses = [f"FE:ED:{i >> 24 & 255:02X}:{i >> 16 & 255:02X}:{i >> 8 & 255:02X}:{i & 255:02X}" for i in range(args.tags)]
+
+    async with database.SessionLocal() as db:
+        db.add(models.User(
+            id=uuid.uuid4(),
+            username="loadtest",
+            hashed_password=auth.hash_password(uuid.uuid4().hex),
+            first_name="Load",
+            last_name="Test",
+            email="loadtest@example.com",
+            role=1
+        ))
+        tags = [models.Tag(id=uuid.uuid4(), name=f"tag-{i}", address=address) for i, address in enumerate(addresses)]
+        credentials = [models.DeviceCredential(id=uuid.uuid4(), tag_id=tag.id, address=tag.address, created_at=datetime.now(), revoked=False) for tag in tags]
+        db.add_all(tags)
+        db.add_all(credentials)
+        db.add_all(
+            models.Anchor(id=uuid.uuid4(), name=f"anchor-{i}", address=f"AN:{i:04d}", height=250.0, pos_x=random.uniform(0, 7000), pos_y=random.uniform(0, 5500))
+            for i in range(args.anchors)
+        )
+        db.add_all(
+            models.Waypoint(id=uuid.uuid4(), name=f"waypoint-{i}", pos_x=random.uniform(0, 7000), pos_y=random.uniform(0, 5500))
+            for i in range(args.waypoints)
+        )
+        await db.commit()
+
+    # The server runs on another event loop; drop connections bound to this one
+    await database.dispose()
+
+    token = auth.create_token(data={"sub": "loadtest"}, expires_delta=timedelta(days=1))
+    # Without DEVICE_TOKEN_SECRET no token can be issued, and none is required
+    devices = {credential.address: device_auth.create_token(credential.id, credential.address) if device_auth.configured else "" for credential in credentials}
+    return addresses, token, devices
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port: int):
+    import uvicorn
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="loadtest-server", daemon=True)
+    thread.start()
+
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start.")
+        time.sleep(0.05)
+
+    return server, thread
+
+#@@@@@ Clients
+async def tag_client(client, recorder: Recorder, address: str, device_token: str, rate: float, stop_at: float):
+    headers = {"Authorization": f"Bearer {device_token}"}
+    interval = 1.0 / rate
+    angle = random.uniform(0, 2 * math.pi)
+
+    # Spread the fleet over the first interval
+    await asyncio.sleep(random.uniform(0, interval))
+
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+        angle += 0.05
+        data = {"address": address, "pos_x": 3500 + 2000 * math.cos(angle), "pos_y": 2750 + 2000 * math.sin(angle)}
+
+        try:
+            response = await client.post("/position", json=data, headers=headers)
+            recorder.record("POST /position", started, response.status_code == 200)
+        except Exception:
+            recorder.record("POST /position", started, False)
+
+        await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+
+async def dashboard_client(client, recorder: Recorder, token: str, interval: float, stop_at: float):
+    headers = {"Authorization": f"Bearer {token}"}
+
+    await asyncio.sleep(random.uniform(0, interval))
+
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+
+        try:
+            response = await client.get("/tags/all", headers=headers)
+            recorder.record("GET /tags/all", started, response.status_code == 200)
+        except Exception:
+            recorder.record("GET /tags/all", started, False)
+
+        await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+
+async def drive(args, base_url: str, addresses: list, token: str, devices: dict) -> Recorder:
+    import httpx
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.fleet + args.dashboards)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        stop_at = time.perf_counter() + args.duration
+        clients = [tag_client(client, recorder, address, devices[address], args.rate, stop_at) for address in addresses[:args.fleet]]
+        clients += [dashboard_client(client, recorder, token, args.poll_interval, stop_at) for _ in range(args.dashboards)]
+        await asyncio.gather(*clients)
+
+    return recorder
+
+def run(args) -> dict:
+    addresses, token, devices = asyncio.run(seed(args))
+
+    port = free_port()
+    server, thread = start_server(port)
+
+    try:
+        started = time.perf_counter()
+        recorder = asyncio.run(drive(args, f"http://127.0.0.1:{port}", addresses, token, devices))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    return {
+        "benchmark": "loadtest",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "routes": recorder.report(elapsed)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="API load test with a synthetic tag fleet")
+    parser.add_argument("--tags", type=int, default=50, help="Tags to seed")
+    parser.add_argument("--anchors", type=int, default=8, help="Anchors to seed")
+    parser.add_argument("--waypoints", type=int, default=200, help="Waypoints to seed")
+    parser.add_argument("--fleet", type=int, default=30, help="Seeded tags that post positions")
+    parser.add_argument("--rate", type=float, default=10.0, help="Position posts per second per tag")
+    parser.add_argument("--dashboards", type=int, default=20, help="Clients polling /tags/all")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between dashboard polls")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic layout")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    args.fleet = min(args.fleet, args.tags)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(directory)
+        report = run(args)
+
+    text = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
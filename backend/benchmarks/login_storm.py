@@ -0,0 +1,117 @@
+# Measures POST /position latency while operators log in concurrently.
+#
+# Boots main.app in-process against a throwaway SQLite database, posts fixes
+# at a fixed rate and reports p50/p95/p99 ingest latency, first on an idle
+# server and then while --logins clients request tokens in a loop. Pass
+# --blocking to run bcrypt on the event loop for comparison.
+#
+# Run from the backend directory (requires httpx and aiosqlite):
+#     python -m benchmarks.login_storm --logins 20 --duration 10
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import tempfile
+import time
+import uuid
+from benchmarks.common import create_tables, percentiles, use_database
+
+async def post_positions(client, address: str, device_token: str, rate: float, duration: float) -> list:
+    headers = {"Authorization": f"Bearer {device_token}"}
+    latencies = []
+    interval = 1.0 / rate
+    stop_at = time.perf_counter() + duration
+
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+        response = await client.post("/position", json={"address": address, "pos_x": 1.0, "pos_y": 2.0}, headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+
+        await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+
+    return latencies
+
+async def login_loop(client, username: str, password: str, stop_at: float) -> int:
+    logins = 0
+    form = {"grant_type": "password", "username": username, "password": password}
+
+    while time.perf_counter() < stop_at:
+        response = await client.post("/token", data=form)
+        response.raise_for_status()
+        logins += 1
+
+    return logins
+
+async def run(args) -> dict:
+    import httpx
+    import database
+    import device_auth
+    import main
+    import models
+    from routers import auth
+
+    password = "benchmark"
+    address = "BE:NC:HM:AR:K0:01"
+
+    await create_tables()
+
+    db = database.SessionLocal()
+    db.add(models.User(
+        id=uuid.uuid4(),
+        username="operator",
+        hashed_password=auth.hash_password(password),
+        first_name="Bench",
+        last_name="Mark",
+        email="operator@example.com"
+    ))
+    tag = models.Tag(id=uuid.uuid4(), name="bench-tag", address=address)
+    credential = models.DeviceCredential(id=uuid.uuid4(), tag_id=tag.id, address=address, created_at=datetime.now(), revoked=False)
+    db.add_all([tag, credential])
+    await db.commit()
+    await db.close()
+
+    # Without DEVICE_TOKEN_SECRET no token can be issued, and none is required
+    device_token = device_auth.create_token(credential.id, address) if device_auth.configured else ""
+
+    if args.blocking:
+        # Previous behaviour: bcrypt runs inline on the event loop
+        async def verify_inline(plaintext_password, hashed_password):
+            return auth.verify_password(plaintext_password, hashed_password)
+        auth.verify_password_async = verify_inline
+
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://autonav") as client:
+            idle = await post_positions(client, address, device_token, args.rate, args.duration)
+
+            stop_at = time.perf_counter() + args.duration
+            storm = [asyncio.create_task(login_loop(client, "operator", password, stop_at)) for _ in range(args.logins)]
+            during = await post_positions(client, address, device_token, args.rate, args.duration)
+            logins = sum(await asyncio.gather(*storm))
+
+    return {
+        "benchmark": "login_storm",
+        "blocking": args.blocking,
+        "password_hash_workers": auth.password_executor._max_workers,
+        "concurrent_logins": args.logins,
+        "logins_completed": logins,
+        "ingest_idle": percentiles(idle),
+        "ingest_during_logins": percentiles(during)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="POST /position latency during a login storm")
+    parser.add_argument("--logins", type=int, default=20, help="Concurrent clients requesting tokens")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per phase")
+    parser.add_argument("--rate", type=float, default=100.0, help="Position posts per second")
+    parser.add_argument("--blocking", action="store_true", help="Verify passwords on the event loop")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(directory)
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Compares the pydantic and the fast serialization paths of the hot list
+# endpoints.
+#
+# For /anchors/all it times fetching --anchors rows from a throwaway SQLite
+# database and encoding them both ways: ORM rows through the AnchorShow
+# TypeAdapter, and plain column tuples through fast_json.RowEncoder. For
+# /tags/all it times encoding --tags in-memory tag store entries both ways.
+# Each measurement is the median of --repeat runs, and the outputs of the
+# two paths are checked to be byte for byte identical, on the timed rows and
+# on rows of edge values (fractions with trailing zeros, whole seconds, UTC,
+# tiny and huge floats, NaN, nulls) that random rows rarely hit.
+#
+# Run from the backend directory (requires aiosqlite):
+#     python -m benchmarks.serialization --anchors 2000 --tags 2000
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import math
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from benchmarks.common import create_tables, git_commit, use_database
+
+async def timed(repeat: int, work) -> tuple:
+    # Returns (median milliseconds, last result)
+    samples = []
+    result = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await work()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return round(statistics.median(samples), 3), result
+
+async def run(args) -> dict:
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    import database
+    import models
+    import schemas
+    from routers import anchors, tags
+    from tag_store import TagEntry
+
+    await create_tables()
+
+    async with database.SessionLocal() as db:
+        db.add_all(
+            models.Anchor(id=uuid.uuid4(), name=f"anchor-{i}", address=f"AN:{i:05d}", height=250.0, pos_x=random.uniform(0, 7000), pos_y=random.uniform(0, 5500))
+            for i in range(args.anchors)
+        )
+        await db.commit()
+
+    async def anchors_pydantic():
+        async with database.SessionLocal() as db:
+            rows = (await db.scalars(select(models.Anchor))).all()
+            return anchors.anchors_adapter.dump_json(anchors.anchors_adapter.validate_python(rows, from_attributes=True))
+
+    async def anchors_fast():
+        async with database.SessionLocal() as db:
+            rows = await db.execute(select(*[getattr(models.Anchor, field) for field in anchors.anchors_encoder.fields]))
+            return anchors.anchors_encoder.encode_rows(rows)
+
+    now = datetime.now()
+    entries = [
+        TagEntry(uuid.uuid4(), f"tag-{i}", f"FE:ED:00:00:{i >> 8 & 255:02X}:{i & 255:02X}", random.uniform(0, 7000), random.uniform(0, 5500), now - timedelta(milliseconds=i))
+        for i in range(args.tags)
+    ]
+    tags_adapter = TypeAdapter(list[schemas.TagShow])
+
+    async def tags_pydantic():
+        return tags_adapter.dump_json(tags_adapter.validate_python(entries, from_attributes=True))
+
+    async def tags_fast():
+        return tags.tags_encoder.encode_objects(entries)
+
+    # Edge values, checked for identical output only
+    values = [1e-05, 1e16, 1e-7, 1.5e300, -0.0, 0.1, 7000.0, math.nan, math.inf]
+    times = [datetime(2024, 1, 1, 12, 0, 1, 320000), datetime(2024, 1, 1, 12, 0, 1), datetime(2024, 1, 1, 12, 0, 1, 5, tzinfo=timezone.utc), None]
+    edge_anchors = [
+        (f"anchor-{i}", f"AN:{i:05d}", value, -value, value * 3, uuid.uuid4())
+        for i, value in enumerate(values)
+    ]
+    edge_tags = [
+        TagEntry(uuid.uuid4(), f"tag-{i}", "FE:ED:00:00:00:00", value, None if i % 2 else value, times[i % len(times)])
+        for i, value in enumerate(values)
+    ]
+    anchors_show = [schemas.AnchorShow(**dict(zip(anchors.anchors_encoder.fields, row))) for row in edge_anchors]
+
+    report = {}
+
+    for name, slow, fast in (("anchors_all", anchors_pydantic, anchors_fast), ("tags_all", tags_pydantic, tags_fast)):
+        slow_ms, slow_body = await timed(args.repeat, slow)
+        fast_ms, fast_body = await timed(args.repeat, fast)
+
+        # Rows come back in table order on both paths
+        report[name] = {
+            "pydantic_ms": slow_ms,
+            "fast_ms": fast_ms,
+            "speedup": round(slow_ms / fast_ms, 2) if fast_ms > 0 else None,
+            "bytes": len(fast_body),
+            "identical": slow_body == fast_body
+        }
+
+    report["anchors_all"]["edge_cases_identical"] = anchors.anchors_adapter.dump_json(anchors_show) == anchors.anchors_encoder.encode_rows(edge_anchors)
+    report["tags_all"]["edge_cases_identical"] = tags_adapter.dump_json(tags_adapter.validate_python(edge_tags, from_attributes=True)) == tags.tags_encoder.encode_objects(edge_tags)
+
+    await database.dispose()
+
+    return {
+        "benchmark": "serialization",
+        "commit": git_commit(),
+        "parameters": vars(args),
+        "paths": report
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Pydantic vs fast serialization of the hot list endpoints")
+    parser.add_argument("--anchors", type=int, default=2000, help="Anchors to seed")
+    parser.add_argument("--tags", type=int, default=2000, help="Tag store entries to encode")
+    parser.add_argument("--repeat", type=int, default=50, help="Runs per measurement")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic rows")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(directory)
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Measures how many fixes per second the UDP ingest path applies on one core.
+#
+# Seeds --tags tags in a throwaway SQLite database, loads the tag store and
+# feeds pre-encoded datagrams of --batch fixes straight into the ingest
+# protocol, so the figure covers decoding, sequence checks, the tag store
+# update and its listeners (stream, history), but not the network stack.
+#
+# Run from the backend directory (requires aiosqlite):
+#     python -m benchmarks.udp_ingest --tags 100 --fixes 200000 --batch 32
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import uuid
+from benchmarks.common import create_tables, git_commit, use_database
+
+async def run(args) -> dict:
+    import database
+    import main
+    import models
+    import udp_ingest
+    from tag_store import store
+
+    await create_tables()
+
+    addresses = [f"0A:0B:0C:0D:{i >> 8 & 255:02X}:{i & 255:02X}" for i in range(args.tags)]
+
+    async with database.SessionLocal() as db:
+        db.add_all(models.Tag(id=uuid.uuid4(), name=f"tag-{i}", address=address) for i, address in enumerate(addresses))
+        await db.commit()
+
+    await store.load()
+
+    datagrams = []
+    sequence = 0
+    now = time.time()
+    for start in range(0, args.fixes, args.batch):
+        fixes = []
+        for i in range(start, min(start + args.batch, args.fixes)):
+            sequence += 1
+            fixes.append((addresses[i % args.tags], sequence, now + i * 1e-4, float(i % 7000), float(i % 5500)))
+        datagrams.append(udp_ingest.encode_datagram(fixes))
+
+    protocol = udp_ingest.IngestProtocol()
+    started = time.perf_counter()
+    for datagram in datagrams:
+        protocol.datagram_received(datagram, None)
+    elapsed = time.perf_counter() - started
+
+    await database.dispose()
+
+    return {
+        "benchmark": "udp_ingest",
+        "commit": git_commit(),
+        "parameters": vars(args),
+        "accepted": udp_ingest.accepted.value,
+        "elapsed_s": round(elapsed, 3),
+        "fixes_per_second": round(args.fixes / elapsed)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP ingest throughput on one core")
+    parser.add_argument("--tags", type=int, default=100, help="Tags to seed")
+    parser.add_argument("--fixes", type=int, default=200000, help="Fixes to ingest")
+    parser.add_argument("--batch", type=int, default=32, help="Fixes per datagram")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(directory)
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
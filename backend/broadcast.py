@@ -0,0 +1,107 @@
+import asyncio
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Fan-out of JSON messages to WebSocket subscribers.
+#
+# Each subscriber keeps a dict of pending messages keyed by the object they
+# describe (e.g. a tag id), so a slow client only ever receives the latest
+# state of each object instead of an ever growing backlog. A client whose
+# pending set still grows past max_pending is disconnected. Messages are
+# sent at most max_rate times per second per client, batched as a JSON array.
+
+class Subscriber:
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = {}
+        self.overflowed = False
+        self.event = asyncio.Event()
+
+    def offer(self, key, message: str):
+        if key not in self.pending and len(self.pending) >= self.max_pending:
+            self.overflowed = True
+        else:
+            self.pending[key] = message
+
+        self.event.set()
+
+class Broadcaster:
+
+    def __init__(self, max_rate: float, max_pending: int):
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.max_pending = max_pending
+
+        self._subscribers = set()
+        self._loop = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(self.max_pending)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, key, message: str):
+        # message is an already encoded JSON value, shared by all subscribers
+        if len(self._subscribers) == 0:
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        # Subscribers may only be touched from the event loop thread
+        if running is self._loop:
+            self._publish(key, message)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, key, message)
+
+    def _publish(self, key, message: str):
+        for subscriber in list(self._subscribers):
+            subscriber.offer(key, message)
+
+    async def _send(self, websocket: WebSocket, subscriber: Subscriber):
+        while True:
+            await subscriber.event.wait()
+            subscriber.event.clear()
+
+            if subscriber.overflowed:
+                await websocket.close(code=1013, reason="Client is not keeping up.")
+                return
+
+            batch = subscriber.pending
+            subscriber.pending = {}
+
+            if len(batch) > 0:
+                await websocket.send_text("[" + ",".join(batch.values()) + "]")
+
+            if self.min_interval > 0:
+                await asyncio.sleep(self.min_interval)
+
+    async def _receive(self, websocket: WebSocket):
+        # Clients do not send anything; this only notices disconnects
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    async def serve(self, websocket: WebSocket, subscriber: Subscriber):
+        # Pump messages to an accepted websocket until either side goes away
+        sender = asyncio.create_task(self._send(websocket, subscriber))
+        receiver = asyncio.create_task(self._receive(websocket))
+
+        try:
+            await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.unsubscribe(subscriber)
+            sender.cancel()
+            receiver.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
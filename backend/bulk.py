@@ -0,0 +1,199 @@
+from autonav_secrets import BULK_MAX_ROWS
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List
+import csv
+import io
+import json
+import uuid
+import database
+
+# Bulk import and streaming export for the layout collections (anchors and
+# waypoints).
+#
+# An import body is a JSON array of objects or a CSV file with a header row
+# (Content-Type: text/csv). Every row is validated before anything is
+# written; if any row is invalid the request fails with 422 and the errors of
+# every invalid row. Valid rows are then checked against the table with one
+# query over the unique columns. Rows that collide with an existing record
+# (or an earlier row of the same import) are reported as conflicts and
+# skipped; the rest are written in one transaction, as one executemany
+# INSERT and one executemany UPDATE.
+#
+# In upsert mode a row updates the record with the same id or, without an
+# id, the record with the same value in the first unique column (the match
+# key, e.g. the anchor address); otherwise it is inserted. Exports include
+# the ids, so an export re-imported with upsert reproduces the layout.
+
+EXPORT_PARTITION_ROWS = 500
+
+rows_adapter = TypeAdapter(List[Dict[str, Any]])
+
+#@@@@@ Import
+async def read_rows(request: Request, item_model: type[BaseModel]) -> list:
+    body = await request.body()
+
+    if request.headers.get("content-type", "").split(";")[0].strip() == "text/csv":
+        try:
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            # Empty cells are missing values
+            raw = [{k: v for k, v in row.items() if k is not None and v != ""} for row in reader]
+        except (UnicodeDecodeError, csv.Error):
+            raise HTTPException(status_code=400, detail="Body is not a valid UTF-8 CSV file.")
+    else:
+        try:
+            raw = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body is not valid JSON.")
+
+        if not isinstance(raw, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of objects.")
+
+    if len(raw) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows can be imported at once.")
+
+    items = []
+    errors = []
+
+    for row, values in enumerate(raw):
+        try:
+            items.append(item_model.model_validate(values))
+        except ValidationError as e:
+            errors.append({
+                "row": row,
+                "errors": [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]
+            })
+
+    if len(errors) > 0:
+        raise HTTPException(status_code=422, detail=errors)
+
+    return items
+
+async def write_rows(db: AsyncSession, model, items: list, unique: tuple, upsert: bool) -> tuple:
+    # Returns (statuses, written) where statuses holds one dict per row and
+    # written the column values of every inserted or updated record
+    table = model.__table__
+    columns = [c for c in items[0].model_fields if c != "id"] if len(items) > 0 else []
+
+    # Current owners of every id and unique value used by the import
+    ids = [item.id for item in items if item.id is not None]
+    conditions = [table.c.id.in_(ids)] if len(ids) > 0 else []
+    for column in unique:
+        values = {getattr(item, column) for item in items if getattr(item, column) is not None}
+        if len(values) > 0:
+            conditions.append(table.c[column].in_(values))
+
+    existing_ids = set()
+    owners = {column: {} for column in unique}
+
+    if len(conditions) > 0:
+        for row in await db.execute(select(table.c.id, *[table.c[c] for c in unique]).where(or_(*conditions))):
+            existing_ids.add(row.id)
+            for column in unique:
+                if row._mapping[column] is not None:
+                    owners[column][row._mapping[column]] = row.id
+
+    claimed = set()
+    statuses = []
+    inserts = []
+    updates = []
+    written = []
+
+    for row, item in enumerate(items):
+        target = None
+
+        if item.id is not None and item.id in existing_ids:
+            target = item.id
+        elif upsert and item.id is None:
+            target = owners[unique[0]].get(getattr(item, unique[0]))
+
+        record_id = target or item.id or uuid.uuid4()
+        conflict = None
+
+        if record_id in claimed:
+            conflict = "Another row of this import already writes this record."
+        elif target is not None and not upsert:
+            conflict = "A record with this id already exists."
+
+        for column in unique:
+            value = getattr(item, column)
+            owner = owners[column].get(value) if value is not None else None
+            if conflict is None and owner is not None and owner != record_id:
+                conflict = f"'{column}' {value!r} is already used by {owner}."
+
+        if conflict is not None:
+            statuses.append({"row": row, "id": target, "status": "conflict", "detail": conflict})
+            continue
+
+        # Later rows of this import may not reuse the record or its values
+        for column in unique:
+            if getattr(item, column) is not None:
+                owners[column][getattr(item, column)] = record_id
+        claimed.add(record_id)
+
+        values = {"id": record_id, **{c: getattr(item, c) for c in columns}}
+        written.append(values)
+
+        if target is None:
+            inserts.append(values)
+            statuses.append({"row": row, "id": record_id, "status": "created", "detail": None})
+        else:
+            updates.append({"b_" + k: v for k, v in values.items()})
+            statuses.append({"row": row, "id": record_id, "status": "updated", "detail": None})
+
+    if len(inserts) > 0:
+        await db.execute(insert(table), inserts)
+
+    if len(updates) > 0:
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values({c: bindparam("b_" + c) for c in columns})
+        )
+        await db.execute(statement, updates)
+
+    return statuses, written
+
+#@@@@@ Export
+async def export_rows(model, fields: list, format: str):
+    # Opens its own session: the request's session is closed before a
+    # streaming body is sent
+    columns = [getattr(model, field) for field in fields]
+
+    async with database.SessionLocal() as db:
+        result = await db.stream(select(*columns).order_by(model.id))
+
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+
+            async for partition in result.partitions(EXPORT_PARTITION_ROWS):
+                writer.writerows(["" if v is None else v for v in row] for row in partition)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+
+            if buffer.tell() > 0:
+                yield buffer.getvalue().encode()
+        else:
+            separator = b"["
+            async for partition in result.partitions(EXPORT_PARTITION_ROWS):
+                chunk = rows_adapter.dump_json([dict(row._mapping) for row in partition])[1:-1]
+                yield separator + chunk
+                separator = b","
+
+            yield b"[]" if separator == b"[" else b"]"
+
+def export_response(model, show_model: type[BaseModel], format: str, name: str) -> StreamingResponse:
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'csv'.")
+
+    return StreamingResponse(
+        export_rows(model, list(show_model.model_fields), format),
+        media_type="text/csv" if format == "csv" else "application/json",
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    )
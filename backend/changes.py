@@ -0,0 +1,68 @@
+from autonav_secrets import CHANGE_FEED_SIZE
+import threading
+import stats
+from collection_cache import process_id
+from tag_store import store, TagEntry
+
+# Sequence-numbered feed of tag changes for clients that poll.
+#
+# Every position fix, create, edit and delete of a tag (as announced by the
+# tag store) gets the next number of a per-process sequence and its tag id
+# is written to a ring buffer of the last CHANGE_FEED_SIZE changes. A
+# client passes the cursor of its previous poll and gets the current state
+# of only the tags that changed after it, plus a new cursor. A cursor from
+# another process, or one older than the ring buffer, asks the client to
+# resync from the full list. Suppressed fixes only refresh last_contact and
+# are not fed; the presence tracker covers liveness.
+
+feed_polls = stats.counter_family("tag_change_polls", "Change feed polls, by outcome.", ("outcome",))
+
+class ChangeFeed:
+
+    def __init__(self, size: int = CHANGE_FEED_SIZE):
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._ring = [None] * size # tag id of change seq at seq % size
+        self._seq = 0 # last assigned
+
+    def cursor(self, seq: int | None = None) -> str:
+        return f"{process_id}-{self._seq if seq is None else seq}"
+
+    def listener(self, kind: str, entry: TagEntry):
+        if kind == "contact":
+            return
+
+        with self._lock:
+            self._seq += 1
+            self._ring[self._seq % self.size] = entry.id
+
+    def since(self, cursor: str | None) -> tuple:
+        # Returns (new cursor, ids of tags changed after cursor in change
+        # order), or (new cursor, None) when the client must resync
+        with self._lock:
+            last = self._seq
+            start = self._parse(cursor)
+
+            if start is None or start > last or start < last - self.size:
+                changed = None
+            else:
+                changed = list(dict.fromkeys(self._ring[seq % self.size] for seq in range(start + 1, last + 1)))
+
+        feed_polls.inc("resync" if changed is None else "incremental")
+        return self.cursor(last), changed
+
+    def _parse(self, cursor: str | None) -> int | None:
+        if cursor is None:
+            return None
+
+        prefix, _, seq = cursor.rpartition("-")
+
+        if prefix != process_id or not seq.isdigit():
+            return None
+
+        return int(seq)
+
+
+feed = ChangeFeed()
+store.add_listener(feed.listener)
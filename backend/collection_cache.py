@@ -0,0 +1,96 @@
+from fastapi import Request, Response
+import time
+import uuid
+import stats
+
+# Pre-serialized list bodies for collections that rarely change.
+#
+# Each collection carries a version counter that the write handlers bump
+# after every successful commit. The list endpoint serves the cached JSON
+# body for the current version with a strong ETag, and answers a matching
+# If-None-Match with 304 without touching the database. The ETag includes a
+# per-process id so versions from before a restart never match.
+#
+# Collections that change all the time (live tags) cannot be versioned per
+# write, so a MicroCache instead reuses one body for a short window: the
+# first request after the window builds it and every request inside the
+# window gets that body. The build rate is then bounded by the window,
+# whatever the number of pollers. Builds are synchronous (the live tags are
+# encoded from memory), so two requests never build at the same time and
+# nothing needs to be coalesced.
+
+process_id = uuid.uuid4().hex[:8]
+
+class CollectionCache:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.version = 0
+
+        self._body = None
+        self._body_version = -1
+
+    def bump(self):
+        self.version += 1
+
+    def etag(self, version: int | None = None) -> str:
+        return f'"{self.name}-{process_id}-{self.version if version is None else version}"'
+
+    def not_modified(self, request: Request) -> bool:
+        header = request.headers.get("if-none-match")
+
+        if header is None:
+            return False
+
+        current = self.etag()
+        for tag in header.split(","):
+            tag = tag.strip()
+            if tag == "*" or tag == current:
+                return True
+
+        return False
+
+    async def response(self, request: Request, build) -> Response:
+        # build is an async callable returning the serialized JSON body
+        headers = {"Cache-Control": "no-cache"}
+
+        if self.not_modified(request):
+            headers["ETag"] = self.etag()
+            return Response(status_code=304, headers=headers)
+
+        version = self.version
+
+        if self._body_version != version:
+            body = await build()
+
+            # Only keep the body if no write happened while it was built
+            if self.version == version:
+                self._body = body
+                self._body_version = version
+        else:
+            body = self._body
+
+        headers["ETag"] = self.etag(version)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+micro_cache_requests = stats.counter_family("micro_cache_requests", "Micro-cached requests, by cache and outcome (hit or built).", ("cache", "outcome"))
+
+class MicroCache:
+
+    def __init__(self, name: str, window: float):
+        self.name = name
+        self.window = window
+
+        self._body = None
+        self._built_at = 0.0
+
+    def get(self, build) -> bytes:
+        # build is a callable returning the serialized body
+        if self._body is not None and time.monotonic() - self._built_at < self.window:
+            micro_cache_requests.inc(self.name, "hit")
+            return self._body
+
+        micro_cache_requests.inc(self.name, "built")
+        self._body = build()
+        self._built_at = time.monotonic()
+        return self._body
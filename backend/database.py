@@ -1,22 +1,110 @@
-from autonav_secrets import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_USERNAME
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from autonav_secrets import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_USERNAME, DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT_SECONDS, DB_POOL_PRE_PING
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
+import os
+import time
+import stats
 
 Base = declarative_base()
 
-# Create a database connection
-# Connect to MySQL database using pymysql
-# In our case, it is MariaDB
-DATABASE_URL = "mysql+pymysql://" + MYSQL_USERNAME + ":" + MYSQL_PASSWORD + "@" + MYSQL_HOST + "/" + MYSQL_DB
+# The engine is created on first use, not at import, so importing the
+# application (tests, tooling, migrate.py) needs neither the database driver
+# nor a reachable database. Tables are managed by migrate.py.
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def database_url() -> str:
+    # Connect to MySQL database using aiomysql
+    # In our case, it is MariaDB
+    # AUTONAV_DATABASE_URL overrides it, e.g. sqlite+aiosqlite:///autonav.db for benchmarks
+    return os.environ.get(
+        "AUTONAV_DATABASE_URL",
+        "mysql+aiomysql://" + MYSQL_USERNAME + ":" + MYSQL_PASSWORD + "@" + MYSQL_HOST + "/" + MYSQL_DB
+    )
 
-# Dependency to get DB session
-def get():
-    db = SessionLocal()
+pool_checkouts = stats.counter("db_pool_checkouts", "Connections checked out of the pool.")
+pool_checkout_wait = stats.counter("db_pool_checkout_wait_seconds", "Total time spent waiting for a pooled connection.")
+
+# Queue pool that records how long each checkout waited for a connection
+class TimedPool(AsyncAdaptedQueuePool):
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkouts.inc()
+            pool_checkout_wait.inc(time.perf_counter() - started)
+
+_engine = None
+_sessionmaker = None
+
+def get_engine() -> AsyncEngine:
+    global _engine, _sessionmaker
+
+    if _engine is None:
+        _engine = create_async_engine(
+            database_url(),
+            poolclass=TimedPool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_POOL_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+            pool_pre_ping=DB_POOL_PRE_PING
+        )
+        _sessionmaker = async_sessionmaker(_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    return _engine
+
+def SessionLocal() -> AsyncSession:
+    get_engine()
+    return _sessionmaker()
+
+async def warm_pool(connections: int):
+    # Open the connections concurrently so each one is a separate pooled
+    # connection, then hand them back to the pool
+    engine = get_engine()
+
+    async def connect():
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+
+    await asyncio.gather(*(connect() for _ in range(connections)))
+
+async def dispose():
+    # Close every pooled connection; the next use creates a new engine
+    global _engine, _sessionmaker
+
+    if _engine is not None:
+        engine = _engine
+        _engine = None
+        _sessionmaker = None
+        await engine.dispose()
+
+# Errors caused by the rows themselves: writing the same rows again fails
+# the same way
+ROW_ERRORS = (DataError, IntegrityError)
+
+async def execute_rows(statement, rows: list) -> list:
+    # Executes statement once per row (executemany) in one transaction and
+    # returns the rows the database rejected. A batch failing with a
+    # ROW_ERRORS error is split in halves until the offending rows are
+    # found, and the others are written. Any other error is raised.
     try:
+        async with SessionLocal() as db:
+            await db.execute(statement, rows)
+            await db.commit()
+        return []
+    except ROW_ERRORS:
+        if len(rows) == 1:
+            return rows
+
+        middle = len(rows) // 2
+        return await execute_rows(statement, rows[:middle]) + await execute_rows(statement, rows[middle:])
+
+stats.gauge("db_pool_connections_in_use", "Connections currently checked out of the pool.", lambda: _engine.pool.checkedout() if _engine is not None else 0)
+
+# Dependency to get DB session
+async def get():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
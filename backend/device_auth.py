@@ -0,0 +1,116 @@
+from autonav_secrets import DEVICE_TOKEN_SECRET, DEVICE_TOKENS_REQUIRED, DEVICE_REVOCATION_REFRESH_SECONDS
+from sqlalchemy import select
+import asyncio
+import base64
+import hashlib
+import hmac
+import uuid
+import database
+import models
+import stats
+
+# Long-lived device tokens for robots posting positions.
+#
+# A token is bound to one tag address and reads
+#
+#   dev1.<credential id, hex>.<tag address>.<HMAC-SHA256 of the first three parts>
+#
+# signed with DEVICE_TOKEN_SECRET (base64url, unpadded). Verifying one is an
+# HMAC and a set lookup: tokens do not expire, and revoked credential ids
+# are kept in memory, loaded from device_credentials on startup and
+# reloaded every DEVICE_REVOCATION_REFRESH_SECONDS. The tag handlers add to
+# the set as soon as they revoke a credential.
+#
+# Anyone could sign tokens with an empty key, so while DEVICE_TOKEN_SECRET
+# is empty no token is issued or accepted, and the backend refuses to start
+# if DEVICE_TOKENS_REQUIRED is set as well.
+
+PREFIX = "dev1"
+
+tokens_accepted = stats.counter("device_tokens_accepted", "Requests authenticated with a device token.")
+tokens_rejected = stats.counter("device_tokens_rejected", "Device tokens rejected as malformed, forged or revoked.")
+
+configured = len(DEVICE_TOKEN_SECRET) > 0
+
+# Keyed once; copying it skips hashing the key for every token
+keyed_mac = hmac.new(DEVICE_TOKEN_SECRET.encode(), digestmod=hashlib.sha256)
+
+def signature(credential_id: uuid.UUID, address: str) -> str:
+    if not configured:
+        raise ValueError("DEVICE_TOKEN_SECRET is not set.")
+
+    mac = keyed_mac.copy()
+    mac.update(f"{PREFIX}.{credential_id.hex}.{address}".encode())
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b"=").decode()
+
+def create_token(credential_id: uuid.UUID, address: str) -> str:
+    return f"{PREFIX}.{credential_id.hex}.{address}.{signature(credential_id, address)}"
+
+def is_device_token(token: str) -> bool:
+    return token.startswith(PREFIX + ".")
+
+class DeviceVerifier:
+
+    def __init__(self, refresh_interval: float = DEVICE_REVOCATION_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+
+        self._revoked = set()
+        self._task = None
+
+    def verify(self, token: str) -> str | None:
+        # Returns the tag address the token is bound to, or None
+        parts = token.split(".")
+
+        try:
+            if len(parts) != 4 or parts[0] != PREFIX:
+                raise ValueError()
+
+            credential_id = uuid.UUID(hex=parts[1])
+
+            if not hmac.compare_digest(signature(credential_id, parts[2]), parts[3]) or credential_id in self._revoked:
+                raise ValueError()
+        except ValueError:
+            tokens_rejected.inc()
+            return None
+
+        tokens_accepted.inc()
+        return parts[2]
+
+    def revoke(self, *credential_ids):
+        self._revoked.update(credential_ids)
+
+    async def load(self):
+        async with database.SessionLocal() as db:
+            revoked = (await db.scalars(select(models.DeviceCredential.id).where(models.DeviceCredential.revoked == True))).all()
+
+        # Revocation is permanent, so ids revoked here since the query
+        # started are kept
+        self._revoked = self._revoked | set(revoked)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Device revocation refresh failed: {e}")
+
+    async def start(self):
+        if not configured:
+            if DEVICE_TOKENS_REQUIRED:
+                raise RuntimeError("DEVICE_TOKENS_REQUIRED is set but DEVICE_TOKEN_SECRET is empty.")
+            print("DEVICE_TOKEN_SECRET is empty; device tokens are disabled.")
+
+        await self.load()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+verifier = DeviceVerifier()
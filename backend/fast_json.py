@@ -0,0 +1,31 @@
+from pydantic import BaseModel, TypeAdapter
+from typing import List
+from typing_extensions import TypedDict
+import operator
+
+# Direct JSON encoding of plain rows for the hot list endpoints.
+#
+# A RowEncoder is built once per Show model. It mirrors the model's fields
+# in a TypedDict and keeps a TypeAdapter for a list of those, so a row (a
+# tuple in field order, or any object with those attributes) only becomes a
+# dict and is written out by pydantic-core's own serializer, without
+# validating and building a pydantic model per row. The output is the same
+# as pydantic's dump_json of the Show model because it is the same
+# serializer: the field types, and so the datetime and float formatting,
+# are taken from the model.
+
+class RowEncoder:
+
+    def __init__(self, show_model: type[BaseModel]):
+        self.fields = list(show_model.model_fields)
+        row = TypedDict(f"{show_model.__name__}Row", {name: field.annotation for name, field in show_model.model_fields.items()})
+        self._adapter = TypeAdapter(List[row])
+        self._getter = operator.attrgetter(*self.fields)
+
+    def encode_rows(self, rows) -> bytes:
+        # rows: tuples with one value per field, in field order
+        fields = self.fields
+        return self._adapter.dump_json([dict(zip(fields, row)) for row in rows])
+
+    def encode_objects(self, objects) -> bytes:
+        return self.encode_rows(map(self._getter, objects))
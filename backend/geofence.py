@@ -0,0 +1,263 @@
+from autonav_secrets import GEOFENCE_FLUSH_INTERVAL_SECONDS, SPATIAL_CELL_SIZE
+from datetime import datetime
+from sqlalchemy import insert, select
+import asyncio
+import math
+import threading
+import database
+import models
+import stats
+from tag_store import store, TagEntry
+
+# Geofence zones evaluated on every accepted position fix.
+#
+# Zones are polygons in map units. ZoneIndex buckets each zone into the grid
+# cells its bounding box overlaps, so locating a point looks up one cell and
+# only tests the few polygons registered there; the cost does not grow with
+# the number of zones elsewhere on the map. The engine keeps the set of zones
+# each tag is in and emits an "enter" or "exit" event when it changes.
+# Events are handed to listeners immediately (for the /zones/stream
+# WebSocket) and written to zone_events in batches by a background task.
+# Readers that need every event merge pending() into what they query; it
+# includes the batch of a flush that has not committed yet.
+#
+# Other subsystems follow events with add_listener(fn); fn(event) is called
+# with the event dict as it is stored (tag_id, zone_id, kind, timestamp).
+
+# Zones whose bounding box spans more cells than this are tested for every
+# point instead of being copied into each cell
+MAX_CELLS_PER_ZONE = 4096
+
+events_insert = insert(models.ZoneEvent.__table__)
+events_emitted = stats.counter_family("geofence_events", "Zone enter and exit events, by kind.", ("kind",))
+
+class Zone:
+    __slots__ = ("id", "name", "points", "min_x", "min_y", "max_x", "max_y")
+
+    def __init__(self, id, name: str, points: list):
+        self.id = id
+        self.name = name
+        self.points = [(float(x), float(y)) for x, y in points]
+        self.min_x = min(x for x, _ in self.points)
+        self.min_y = min(y for _, y in self.points)
+        self.max_x = max(x for x, _ in self.points)
+        self.max_y = max(y for _, y in self.points)
+
+    def contains(self, x: float, y: float) -> bool:
+        if x < self.min_x or x > self.max_x or y < self.min_y or y > self.max_y:
+            return False
+
+        # Even-odd ray casting towards +x
+        inside = False
+        points = self.points
+        x1, y1 = points[-1]
+
+        for x2, y2 in points:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            x1, y1 = x2, y2
+
+        return inside
+
+class ZoneIndex:
+
+    def __init__(self, cell_size: float, zones: list):
+        self.cell_size = cell_size
+        self._cells = {} # (cx, cy) -> [Zone]
+        self._large = []
+
+        for zone in zones:
+            low_x, low_y = self._cell(zone.min_x, zone.min_y)
+            high_x, high_y = self._cell(zone.max_x, zone.max_y)
+
+            if (high_x - low_x + 1) * (high_y - low_y + 1) > MAX_CELLS_PER_ZONE:
+                self._large.append(zone)
+                continue
+
+            for cx in range(low_x, high_x + 1):
+                for cy in range(low_y, high_y + 1):
+                    self._cells.setdefault((cx, cy), []).append(zone)
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def locate(self, x: float, y: float) -> frozenset:
+        # Ids of every zone containing the point
+        candidates = self._cells.get(self._cell(x, y), ())
+        found = [zone.id for zone in candidates if zone.contains(x, y)]
+        found += [zone.id for zone in self._large if zone.contains(x, y)]
+        return frozenset(found)
+
+class GeofenceEngine:
+
+    def __init__(self, cell_size: float = SPATIAL_CELL_SIZE, flush_interval: float = GEOFENCE_FLUSH_INTERVAL_SECONDS):
+        self.cell_size = cell_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._zones = {} # zone id -> Zone
+        self._index = ZoneIndex(cell_size, [])
+        self._inside = {} # tag id -> frozenset of zone ids
+        self._pending = []
+        self._flushing = [] # batch of the flush in progress
+        self._listeners = []
+
+        self._task = None
+
+    #@@@@@ Listeners
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _emit(self, events: list):
+        for event in events:
+            events_emitted.inc(event["kind"])
+            for listener in self._listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    print(f"Geofence listener failed: {e}")
+
+    #@@@@@ Evaluation
+    def _evaluate(self, entry: TagEntry, timestamp: datetime, events: list):
+        # Caller holds the lock
+        if entry.pos_x is None or entry.pos_y is None:
+            current = frozenset()
+        else:
+            current = self._index.locate(entry.pos_x, entry.pos_y)
+
+        previous = self._inside.get(entry.id, frozenset())
+
+        if current == previous:
+            return
+
+        for zone_id in previous - current:
+            events.append({"tag_id": entry.id, "zone_id": zone_id, "kind": "exit", "timestamp": timestamp})
+        for zone_id in current - previous:
+            events.append({"tag_id": entry.id, "zone_id": zone_id, "kind": "enter", "timestamp": timestamp})
+
+        if len(current) > 0:
+            self._inside[entry.id] = current
+        else:
+            self._inside.pop(entry.id, None)
+
+    def _record(self, events: list):
+        if len(events) == 0:
+            return
+
+        with self._lock:
+            self._pending.extend(events)
+
+        self._emit(events)
+
+    def listener(self, kind: str, entry: TagEntry):
+        if kind == "remove":
+            with self._lock:
+                self._inside.pop(entry.id, None)
+            return
+
+        if kind != "position":
+            return
+
+        events = []
+        with self._lock:
+            self._evaluate(entry, entry.last_contact, events)
+
+        self._record(events)
+
+    def _rebuild(self, emit: bool):
+        # Re-evaluate every tag against the changed zones
+        timestamp = datetime.now()
+        events = []
+
+        with self._lock:
+            self._index = ZoneIndex(self.cell_size, list(self._zones.values()))
+            for entry in store.all():
+                self._evaluate(entry, timestamp, events)
+
+        if emit:
+            self._record(events)
+
+    #@@@@@ Zones
+    def put_zone(self, zone: models.Zone):
+        with self._lock:
+            self._zones[zone.id] = Zone(zone.id, zone.name, zone.points)
+        self._rebuild(emit=True)
+
+    def remove_zone(self, zone_id):
+        with self._lock:
+            self._zones.pop(zone_id, None)
+        self._rebuild(emit=True)
+
+    async def load(self):
+        async with database.SessionLocal() as db:
+            zones = (await db.scalars(select(models.Zone))).all()
+
+        with self._lock:
+            self._zones = {zone.id: Zone(zone.id, zone.name, zone.points) for zone in zones}
+            self._inside = {}
+
+        # Tags already inside a zone at startup do not produce events
+        self._rebuild(emit=False)
+
+    #@@@@@ Reads
+    def zones_of(self, tag_id) -> frozenset:
+        return self._inside.get(tag_id, frozenset())
+
+    def occupants(self, zone_id) -> list:
+        return [tag_id for tag_id, zones in list(self._inside.items()) if zone_id in zones]
+
+    #@@@@@ Write-behind flushing
+    def pending(self) -> list:
+        # Events not written to zone_events yet, oldest first
+        with self._lock:
+            return self._flushing + self._pending
+
+    async def flush(self) -> int:
+        with self._lock:
+            events, self._pending = self._pending, []
+            self._flushing = events
+
+        if len(events) == 0:
+            return 0
+
+        try:
+            async with database.SessionLocal() as db:
+                await db.execute(events_insert, events)
+                await db.commit()
+        except:
+            # Keep the events for the next flush
+            with self._lock:
+                self._flushing = []
+                self._pending = events + self._pending
+            raise
+
+        with self._lock:
+            self._flushing = []
+
+        return len(events)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Geofence flush failed: {e}")
+
+    async def start(self):
+        await self.load()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.flush()
+
+
+engine = GeofenceEngine()
+store.add_listener(engine.listener)
@@ -0,0 +1,207 @@
+from autonav_secrets import HISTORY_FLUSH_INTERVAL_SECONDS, HISTORY_FLUSH_MAX_ATTEMPTS
+from datetime import datetime
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import threading
+import database
+import models
+import stats
+from tag_store import store, TagEntry
+
+# Append-only position history, written in batches off the request path.
+#
+# Every accepted fix is buffered in memory and inserted into
+# position_history by a background task. Fixes are also pre-aggregated
+# into fixed-width buckets (ROLLUP_RESOLUTIONS, in seconds) stored in
+# position_rollups as sample counts and coordinate sums, so range queries
+# at coarse resolutions read one row per bucket instead of every raw fix.
+# A bucket is written once it has ended; a late fix for an already written
+# bucket becomes a second row for that bucket and is summed at query time.
+#
+# Rows the database rejects (database.ROW_ERRORS) are dropped and counted.
+# Rows of a flush that failed otherwise, e.g. with the database down, are
+# kept for the next one, until HISTORY_FLUSH_MAX_ATTEMPTS flushes in a row
+# have failed; then everything buffered is dropped.
+
+ROLLUP_RESOLUTIONS = (60, 1)
+
+rows_dropped = stats.counter_family("history_rows_dropped", "History rows dropped, by reason.", ("reason",))
+
+history_insert = insert(models.PositionHistory.__table__)
+rollups_insert = insert(models.PositionRollup.__table__)
+
+def to_millis(timestamp: datetime) -> int:
+    return int(timestamp.timestamp() * 1000)
+
+class HistoryWriter:
+
+    def __init__(self, flush_interval: float = HISTORY_FLUSH_INTERVAL_SECONDS, max_attempts: int = HISTORY_FLUSH_MAX_ATTEMPTS):
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._fixes = []
+        self._rollups = []
+        self._open = {} # (tag_id, resolution) -> [bucket, samples, sum_x, sum_y]
+        self._failures = 0 # failed flushes in a row
+
+        self._task = None
+
+    #@@@@@ Recording
+    def record(self, entry: TagEntry):
+        timestamp = to_millis(entry.last_contact)
+
+        with self._lock:
+            self._fixes.append({
+                "tag_id": entry.id,
+                "timestamp": timestamp,
+                "pos_x": entry.pos_x,
+                "pos_y": entry.pos_y
+            })
+
+            for resolution in ROLLUP_RESOLUTIONS:
+                width = resolution * 1000
+                bucket = timestamp - timestamp % width
+                key = (entry.id, resolution)
+                current = self._open.get(key)
+
+                if current is not None and current[0] != bucket:
+                    self._close(key, current)
+                    current = None
+
+                if current is None:
+                    current = self._open[key] = [bucket, 0, 0.0, 0.0]
+
+                current[1] += 1
+                current[2] += entry.pos_x
+                current[3] += entry.pos_y
+
+    def _close(self, key: tuple, current: list):
+        self._rollups.append({
+            "tag_id": key[0],
+            "resolution": key[1],
+            "bucket": current[0],
+            "samples": current[1],
+            "sum_x": current[2],
+            "sum_y": current[3]
+        })
+        del self._open[key]
+
+    def listener(self, kind: str, entry: TagEntry):
+        if kind == "position":
+            self.record(entry)
+
+    #@@@@@ Flushing
+    async def flush(self) -> int:
+        now = to_millis(datetime.now())
+
+        with self._lock:
+            # Buckets that have ended will not receive more in-order fixes
+            for key, current in list(self._open.items()):
+                if current[0] + key[1] * 1000 <= now:
+                    self._close(key, current)
+
+            fixes, self._fixes = self._fixes, []
+            rollups, self._rollups = self._rollups, []
+
+        if len(fixes) == 0 and len(rollups) == 0:
+            return 0
+
+        written = len(fixes)
+        rejected = []
+
+        try:
+            if len(fixes) > 0:
+                rejected += await database.execute_rows(history_insert, fixes)
+                written -= len(rejected)
+                fixes = []
+            if len(rollups) > 0:
+                rejected += await database.execute_rows(rollups_insert, rollups)
+                rollups = []
+        except:
+            self._failures += 1
+
+            if self._failures >= self.max_attempts:
+                self._failures = 0
+                rows_dropped.inc("failed", amount=len(fixes) + len(rollups))
+            else:
+                # Keep the unwritten rows for the next flush
+                with self._lock:
+                    self._fixes = fixes + self._fixes
+                    self._rollups = rollups + self._rollups
+            raise
+        finally:
+            if len(rejected) > 0:
+                rows_dropped.inc("rejected", amount=len(rejected))
+                print(f"History rows rejected by the database and dropped: {len(rejected)}")
+
+        self._failures = 0
+        return written
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"History flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        with self._lock:
+            for key, current in list(self._open.items()):
+                self._close(key, current)
+
+        await self.flush()
+
+#@@@@@ Range queries
+async def query(db: AsyncSession, tag_id, start: datetime, end: datetime, resolution: float) -> list:
+    # Returns (timestamp, pos_x, pos_y, samples) rows averaged over buckets
+    # of `resolution` seconds, oldest first
+    start_ms = to_millis(start)
+    end_ms = to_millis(end)
+    width = max(int(resolution * 1000), 1)
+
+    # Use the coarsest rollup whose buckets nest evenly in the requested ones
+    level = next((r for r in ROLLUP_RESOLUTIONS if width % (r * 1000) == 0), None)
+
+    if level is None:
+        table = models.PositionHistory
+        bucket = table.timestamp // width
+        statement = (
+            select(bucket, func.avg(table.pos_x), func.avg(table.pos_y), func.count())
+            .where(table.tag_id == tag_id)
+            .where(table.timestamp >= start_ms)
+            .where(table.timestamp < end_ms)
+        )
+    else:
+        table = models.PositionRollup
+        bucket = table.bucket // width
+        samples = func.sum(table.samples)
+        statement = (
+            select(bucket, func.sum(table.sum_x) / samples, func.sum(table.sum_y) / samples, samples)
+            .where(table.tag_id == tag_id)
+            .where(table.resolution == level)
+            .where(table.bucket >= start_ms - start_ms % (level * 1000))
+            .where(table.bucket < end_ms)
+        )
+
+    statement = statement.group_by(bucket).order_by(bucket)
+
+    return [
+        (datetime.fromtimestamp(b * width / 1000), x, y, int(n))
+        for b, x, y, n in await db.execute(statement)
+    ]
+
+
+writer = HistoryWriter()
+store.add_listener(writer.listener)
@@ -1,8 +1,13 @@
 #@@@@@ Library Imports
-from autonav_secrets import JWT_TOKEN_EXPIRE_MINUTES
+import time
+import_started = time.perf_counter()
+
+from autonav_secrets import DB_POOL_SIZE, DB_POOL_WARM_CONNECTIONS, JWT_TOKEN_EXPIRE_MINUTES
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import Annotated, List
@@ -15,18 +20,66 @@ import routers.tags
 import routers.anchors
 import routers.waypoints
 import routers.position
+import routers.zones
+import routers.maps
 import models
 import uuid
+from tag_store import store
+import history
+import spatial
+import routing
+import geofence
+import presence
+import device_auth
+import metrics
+import stats
+import udp_ingest
 
-#@@@@@ Application Setup
-# Create database tables
-database.Base.metadata.create_all(bind=database.engine)
+import_seconds = time.perf_counter() - import_started
 
+#@@@@@ Application Setup
 # Set Global Version Identifiers
 version = schemas.VersionBase(version="v1")
 
+# Cold start of this worker: importing the application, then the startup
+# half of the lifespan. Tables are not touched here; run migrate.py first.
+cold_start = {"import_seconds": import_seconds, "startup_seconds": 0.0}
+
+stats.gauge("startup_import_seconds", "Time this worker spent importing the application.", lambda: cold_start["import_seconds"])
+stats.gauge("startup_lifespan_seconds", "Time this worker spent in startup before serving.", lambda: cold_start["startup_seconds"])
+
+# Warm the connection pool, load live tag state, revoked device credentials,
+# the spatial indexes, the navigation graph, zones and tag presence, and
+# start persisting positions, history and zone events in the background
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+
+    await database.warm_pool(min(DB_POOL_WARM_CONNECTIONS, DB_POOL_SIZE))
+    await store.start()
+    await device_auth.verifier.start()
+    await spatial.start()
+    await routing.start()
+    await geofence.engine.start()
+    await presence.tracker.start()
+    history.writer.start()
+    await udp_ingest.start()
+
+    cold_start["startup_seconds"] = time.perf_counter() - started
+    print(f"Worker ready: import {cold_start['import_seconds']:.3f} s, startup {cold_start['startup_seconds']:.3f} s")
+
+    yield
+
+    udp_ingest.stop()
+    await history.writer.stop()
+    await geofence.engine.stop()
+    await presence.tracker.stop()
+    await store.stop()
+    await device_auth.verifier.stop()
+    await database.dispose()
+
 # Create FastAPI Application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS Middleware
 origins = ["*"]
@@ -37,8 +90,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# Per-route latency, payload size, DB usage and exception metrics
+metrics.install(app)
+
 
 app.include_router(routers.auth.router)
 
@@ -62,7 +119,30 @@ app.include_router(
     routers.position.router,
     prefix="/position"
 )
+app.include_router(
+    routers.zones.router,
+    prefix="/zones"
+)
+app.include_router(
+    routers.maps.router,
+    prefix="/maps"
+)
 
 @app.get("/version", response_model=schemas.VersionGet)
 async def get_version():
     return version
+
+# Admin ============= GET Stats: Internal cache and pipeline counters
+@app.get("/stats")
+async def get_stats(
+    requester: Annotated[schemas.UserShow, Depends(routers.auth.authenticate_token)]
+):
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    return stats.snapshot()
+
+# Public ============ GET Metrics: Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(stats.render_prometheus(), media_type="text/plain; version=0.0.4")
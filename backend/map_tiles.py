@@ -0,0 +1,169 @@
+from autonav_secrets import MAP_TILE_DIRECTORY, MAP_TILE_SIZE, MAP_OPEN_ARCHIVES
+from collections import OrderedDict
+from PIL import Image
+import hashlib
+import io
+import math
+import mmap
+import os
+import struct
+import threading
+
+# Tile pyramids of the floor plan images.
+#
+# An uploaded image is cut once into MAP_TILE_SIZE PNG tiles at every zoom
+# level, from z = 0 (the whole image fits in one tile) to the last level at
+# the native resolution, each level half the size of the next. Edge tiles
+# are padded with transparency. All tiles of one image are packed into a
+# single archive file in MAP_TILE_DIRECTORY:
+#
+#   header  4s magic b"ANTL", B format (1), H tile size, I width, I height,
+#           B number of levels
+#   levels  H columns, H rows per level, smallest first
+#   index   Q offset, I length per tile, level by level, row-major
+#   data    PNG tiles
+#
+# Archives are memory-mapped when first read, so serving a tile is a slice
+# of the page cache. The archive name holds a hash of the image, which the
+# tile URLs carry too; a new upload gets new URLs, so tiles can be cached
+# by clients forever.
+
+MAGIC = b"ANTL"
+FORMAT = 1
+HEADER = struct.Struct("<4sBHIIB")
+LEVEL = struct.Struct("<HH")
+ENTRY = struct.Struct("<QI")
+
+def archive_path(map_id, tiles_version: str) -> str:
+    return os.path.join(MAP_TILE_DIRECTORY, f"{map_id}-{tiles_version}.tiles")
+
+def image_version(data: bytes) -> str:
+    return hashlib.sha256(data + str(MAP_TILE_SIZE).encode()).hexdigest()[:16]
+
+#@@@@@ Generation
+def build_archive(data: bytes, path: str, tile_size: int = MAP_TILE_SIZE) -> tuple:
+    # Cuts the image into a tile archive at path; returns (width, height,
+    # number of levels). CPU bound: run it off the event loop.
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert("RGBA")
+
+    width, height = image.size
+    count = max(math.ceil(math.log2(max(width, height) / tile_size)), 0) + 1
+
+    # Native resolution first, each next level downscaled from the previous
+    levels = [image]
+    for _ in range(count - 1):
+        previous = levels[-1]
+        levels.append(previous.resize((max(math.ceil(previous.width / 2), 1), max(math.ceil(previous.height / 2), 1)), Image.LANCZOS))
+    levels.reverse()
+
+    dims = [(math.ceil(level.width / tile_size), math.ceil(level.height / tile_size)) for level in levels]
+    index_start = HEADER.size + LEVEL.size * count
+    data_start = index_start + ENTRY.size * sum(cols * rows for cols, rows in dims)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = path + ".tmp"
+    entries = []
+
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, tile_size, width, height, count))
+        for cols, rows in dims:
+            f.write(LEVEL.pack(cols, rows))
+
+        f.seek(data_start)
+        offset = data_start
+
+        for level, (cols, rows) in zip(levels, dims):
+            for y in range(rows):
+                for x in range(cols):
+                    buffer = io.BytesIO()
+                    level.crop((x * tile_size, y * tile_size, (x + 1) * tile_size, (y + 1) * tile_size)).save(buffer, format="PNG")
+                    tile = buffer.getvalue()
+                    f.write(tile)
+                    entries.append(ENTRY.pack(offset, len(tile)))
+                    offset += len(tile)
+
+        f.seek(index_start)
+        f.write(b"".join(entries))
+
+    # Readers never see a partly written archive
+    os.replace(temporary, path)
+
+    return width, height, count
+
+#@@@@@ Serving
+class TileArchive:
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format, self.tile_size, self.width, self.height, count = HEADER.unpack_from(self._map)
+
+        if magic != MAGIC or format != FORMAT:
+            self._map.close()
+            raise ValueError(f"{path} is not a tile archive.")
+
+        # (columns, rows, first index entry) per level
+        self.levels = []
+        first = 0
+        for z in range(count):
+            cols, rows = LEVEL.unpack_from(self._map, HEADER.size + z * LEVEL.size)
+            self.levels.append((cols, rows, first))
+            first += cols * rows
+
+        self._index_start = HEADER.size + LEVEL.size * count
+
+    def tile(self, z: int, x: int, y: int) -> bytes | None:
+        if z < 0 or z >= len(self.levels):
+            return None
+
+        cols, rows, first = self.levels[z]
+
+        if x < 0 or x >= cols or y < 0 or y >= rows:
+            return None
+
+        offset, length = ENTRY.unpack_from(self._map, self._index_start + (first + y * cols + x) * ENTRY.size)
+        return self._map[offset:offset + length]
+
+    def close(self):
+        self._map.close()
+
+class ArchiveCache:
+    # Keeps the most recently used archives mapped
+
+    def __init__(self, size: int = MAP_OPEN_ARCHIVES):
+        self.size = size
+        self._lock = threading.Lock()
+        self._archives = OrderedDict()
+
+    def get(self, path: str) -> TileArchive | None:
+        with self._lock:
+            archive = self._archives.get(path)
+
+            if archive is not None:
+                self._archives.move_to_end(path)
+                return archive
+
+            try:
+                archive = TileArchive(path)
+            except (FileNotFoundError, ValueError):
+                return None
+
+            self._archives[path] = archive
+
+            while len(self._archives) > self.size:
+                _, evicted = self._archives.popitem(last=False)
+                evicted.close()
+
+            return archive
+
+    def discard(self, path: str):
+        with self._lock:
+            archive = self._archives.pop(path, None)
+
+        if archive is not None:
+            archive.close()
+
+
+archives = ArchiveCache()
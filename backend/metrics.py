@@ -0,0 +1,132 @@
+from contextvars import ContextVar
+from fastapi import Request
+from fastapi.exception_handlers import http_exception_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.exceptions import HTTPException as StarletteHTTPException
+import time
+import stats
+
+# Per-route request metrics and per-request database usage.
+#
+# MetricsMiddleware times every HTTP request and counts response bytes.
+# The SQLAlchemy cursor hooks below add each query and its duration to the
+# RequestUsage of the request that issued it (found through a context
+# variable) and to process-wide totals. Route labels use the route template
+# (e.g. /tags/{tag_id}) so label cardinality stays bounded.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128.0, 512.0, 2048.0, 8192.0, 32768.0, 131072.0, 524288.0, 2097152.0)
+QUERY_BUCKETS = (0.0, 1.0, 2.0, 3.0, 5.0, 10.0, 25.0, 100.0)
+
+request_duration = stats.histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"), LATENCY_BUCKETS)
+response_size = stats.histogram("http_response_size_bytes", "HTTP response body size by route.", ("method", "route"), SIZE_BUCKETS)
+request_queries = stats.histogram("http_request_db_queries", "Database queries issued per HTTP request by route.", ("method", "route"), QUERY_BUCKETS)
+request_db_time = stats.histogram("http_request_db_seconds", "Database time per HTTP request by route.", ("method", "route"), LATENCY_BUCKETS)
+requests = stats.counter_family("http_requests", "HTTP requests by route and status code.", ("method", "route", "status"))
+exceptions = stats.counter_family("exceptions", "Exceptions raised while handling requests, by type.", ("type",))
+db_queries = stats.counter("db_queries", "Database queries executed.")
+db_query_time = stats.counter("db_query_seconds", "Total time spent executing database queries.")
+
+class RequestUsage:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+current_usage = ContextVar("current_usage", default=None)
+
+def route_label(scope: dict) -> str:
+    # The full path template, router prefix included. FastAPI versions that
+    # keep included routers intact leave the router-relative APIRoute in
+    # scope["route"] and record the full template in the effective route
+    # context, which is what FastAPI's own telemetry reports.
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    path = getattr(context, "path_format", None)
+    if path is not None:
+        return path
+
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return endpoint.__name__
+
+    return "unmatched"
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        usage = RequestUsage()
+        token = current_usage.set(usage)
+        response = [500, 0] # status, body bytes
+
+        async def send_measured(message):
+            if message["type"] == "http.response.start":
+                response[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                response[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        except Exception as e:
+            exceptions.inc(type(e).__name__)
+            raise
+        finally:
+            current_usage.reset(token)
+
+            method = scope["method"]
+            route = route_label(scope)
+            request_duration.observe(time.perf_counter() - started, method, route)
+            response_size.observe(response[1], method, route)
+            request_queries.observe(usage.queries, method, route)
+            request_db_time.observe(usage.db_time, method, route)
+            requests.inc(method, route, str(response[0]))
+
+async def count_handled_exception(request: Request, exc: StarletteHTTPException):
+    # Handlers turn unexpected errors into HTTPException(500) inside an
+    # except block; the original exception is kept as __context__
+    if exc.__context__ is not None and exc.status_code >= 500:
+        exceptions.inc(type(exc.__context__).__name__)
+
+    return await http_exception_handler(request, exc)
+
+#@@@@@ Database hooks
+# Registered on the Engine class so they apply to the engine created lazily
+# by database.get_engine()
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+
+    db_queries.inc()
+    db_query_time.inc(elapsed)
+
+    usage = current_usage.get()
+    if usage is not None:
+        usage.queries += 1
+        usage.db_time += elapsed
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+def install(app):
+    app.add_middleware(MetricsMiddleware)
+    app.add_exception_handler(StarletteHTTPException, count_handled_exception)
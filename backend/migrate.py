@@ -0,0 +1,105 @@
+# Schema management for the backend database.
+#
+#     python migrate.py            create missing tables, apply pending migrations
+#     python migrate.py --check    exit with status 1 if anything is pending
+#
+# The server never changes the schema itself; run this before starting a new
+# version. Missing tables are created from models.py (create_all only adds
+# tables, it never alters existing ones). Changes to existing tables are
+# listed in MIGRATIONS as (id, function) pairs, applied in order, each in its
+# own transaction, and recorded in schema_migrations so they run once. On a
+# fresh database the tables are created from the current models, which
+# already include those changes, so the steps are only recorded.
+import argparse
+import asyncio
+from datetime import datetime
+from sqlalchemy import inspect, insert, select
+import sys
+import database
+import models
+
+def create_index(table, name: str):
+    index = next(index for index in table.indexes if index.name == name)
+    return lambda sync_conn: index.create(sync_conn, checkfirst=True)
+
+async def add_tags_last_contact_index(conn):
+    await conn.run_sync(create_index(models.Tag.__table__, "ix_tags_last_contact"))
+
+# (id, async function taking an AsyncConnection), oldest first
+MIGRATIONS = [
+    ("0001_tags_last_contact_index", add_tags_last_contact_index),
+]
+
+def existing_tables(sync_conn) -> set:
+    return set(inspect(sync_conn).get_table_names())
+
+async def status(conn) -> tuple:
+    # Returns (existing tables, missing tables, ids of pending migrations)
+    tables = await conn.run_sync(existing_tables)
+    missing = [table.name for table in database.Base.metadata.sorted_tables if table.name not in tables]
+    applied = set()
+
+    if models.SchemaMigration.__tablename__ in tables:
+        applied = set((await conn.execute(select(models.SchemaMigration.id))).scalars())
+
+    return tables, missing, [id for id, _ in MIGRATIONS if id not in applied]
+
+async def upgrade() -> tuple:
+    # Returns (created tables, applied migration ids)
+    engine = database.get_engine()
+
+    async with engine.begin() as conn:
+        tables, missing, pending = await status(conn)
+        fresh = models.User.__tablename__ not in tables
+        await conn.run_sync(database.Base.metadata.create_all)
+
+    applied = []
+
+    for id, step in MIGRATIONS:
+        if id not in pending:
+            continue
+
+        async with engine.begin() as conn:
+            if not fresh:
+                await step(conn)
+            await conn.execute(insert(models.SchemaMigration.__table__).values(id=id, applied_at=datetime.now()))
+
+        applied.append(id)
+
+    return missing, applied
+
+async def run(check: bool) -> int:
+    try:
+        if check:
+            async with database.get_engine().connect() as conn:
+                _, missing, pending = await status(conn)
+
+            for table in missing:
+                print(f"Missing table: {table}")
+            for id in pending:
+                print(f"Pending migration: {id}")
+
+            return 1 if len(missing) > 0 or len(pending) > 0 else 0
+
+        missing, applied = await upgrade()
+
+        for table in missing:
+            print(f"Created table: {table}")
+        for id in applied:
+            print(f"Applied migration: {id}")
+        if len(missing) == 0 and len(applied) == 0:
+            print("Schema is up to date.")
+
+        return 0
+    finally:
+        await database.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Create missing tables and apply pending schema migrations")
+    parser.add_argument("--check", action="store_true", help="Only report what is pending; exit with status 1 if anything is")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(run(args.check)))
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import uuid
-from sqlalchemy import Column
-from sqlalchemy.types import UUID, Integer, VARCHAR, Boolean, DateTime, FLOAT
+from sqlalchemy import Column, Index, UniqueConstraint
+from sqlalchemy.types import UUID, Integer, BigInteger, VARCHAR, Boolean, DateTime, FLOAT, DOUBLE, JSON
 import database
 
+class SchemaMigration(database.Base):
+    __tablename__ = "schema_migrations"
+    id = Column(VARCHAR(100), primary_key=True)
+    applied_at = Column(DateTime(timezone=True), nullable=False)
+
 class User(database.Base):
     __tablename__ = "users"
 
@@ -24,6 +29,19 @@ class Tag(database.Base):
     pos_y = Column(FLOAT, nullable=True)
     last_contact = Column(DateTime(timezone=True), nullable=True)
 
+    __table_args__ = (
+        Index("ix_tags_last_contact", "last_contact"),
+    )
+
+class DeviceCredential(database.Base):
+    __tablename__ = "device_credentials"
+    id = Column(UUID, primary_key=True, default=lambda: uuid.uuid4())
+    tag_id = Column(UUID, nullable=False, index=True)
+    address = Column(VARCHAR(23), nullable=False) # Tag address the token is bound to
+    name = Column(VARCHAR(50), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    revoked = Column(Boolean, nullable=False, default=False)
+
 class Anchor(database.Base):
     __tablename__ = "anchors"
     id = Column(UUID, primary_key=True, default=lambda: uuid.uuid4())
@@ -39,3 +57,78 @@ class Waypoint(database.Base):
     name = Column(VARCHAR(50), unique=True, nullable=True)
     pos_x = Column(FLOAT, nullable=False, default=0.0)
     pos_y = Column(FLOAT, nullable=False, default=0.0)
+
+class WaypointEdge(database.Base):
+    __tablename__ = "waypoint_edges"
+    id = Column(UUID, primary_key=True, default=lambda: uuid.uuid4())
+    waypoint_a = Column(UUID, nullable=False) # Undirected; stored with waypoint_a < waypoint_b
+    waypoint_b = Column(UUID, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("waypoint_a", "waypoint_b", name="uq_waypoint_edges_ends"),
+        Index("ix_waypoint_edges_waypoint_b", "waypoint_b"),
+    )
+
+class Map(database.Base):
+    __tablename__ = "maps"
+    id = Column(UUID, primary_key=True, default=lambda: uuid.uuid4())
+    site = Column(VARCHAR(50), nullable=False)
+    floor = Column(VARCHAR(20), nullable=False)
+    name = Column(VARCHAR(50), nullable=True)
+    pixels_per_metre = Column(FLOAT, nullable=False, default=1.0)
+    origin_x = Column(FLOAT, nullable=False, default=0.0) # Pixel column of the map origin
+    origin_y = Column(FLOAT, nullable=False, default=0.0) # Pixel row of the map origin
+    width = Column(Integer, nullable=True) # Image size in pixels, set on upload
+    height = Column(Integer, nullable=True)
+    tile_size = Column(Integer, nullable=True)
+    levels = Column(Integer, nullable=True) # Zoom levels of the tile pyramid
+    tiles_version = Column(VARCHAR(16), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("site", "floor", name="uq_maps_site_floor"),
+    )
+
+class PositionHistory(database.Base):
+    __tablename__ = "position_history"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    tag_id = Column(UUID, nullable=False)
+    timestamp = Column(BigInteger, nullable=False) # Milliseconds since epoch
+    pos_x = Column(FLOAT, nullable=False)
+    pos_y = Column(FLOAT, nullable=False)
+
+    __table_args__ = (
+        Index("ix_position_history_tag_timestamp", "tag_id", "timestamp"),
+    )
+
+class PositionRollup(database.Base):
+    __tablename__ = "position_rollups"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    tag_id = Column(UUID, nullable=False)
+    resolution = Column(Integer, nullable=False) # Bucket width in seconds
+    bucket = Column(BigInteger, nullable=False) # Bucket start, milliseconds since epoch
+    samples = Column(Integer, nullable=False)
+    sum_x = Column(DOUBLE, nullable=False)
+    sum_y = Column(DOUBLE, nullable=False)
+
+    __table_args__ = (
+        Index("ix_position_rollups_tag_resolution_bucket", "tag_id", "resolution", "bucket"),
+    )
+
+class Zone(database.Base):
+    __tablename__ = "zones"
+    id = Column(UUID, primary_key=True, default=lambda: uuid.uuid4())
+    name = Column(VARCHAR(50), unique=True, nullable=False)
+    points = Column(JSON, nullable=False) # Polygon vertices as [[x, y], ...]
+
+class ZoneEvent(database.Base):
+    __tablename__ = "zone_events"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    tag_id = Column(UUID, nullable=False)
+    zone_id = Column(UUID, nullable=False)
+    kind = Column(VARCHAR(5), nullable=False) # "enter" or "exit"
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_zone_events_tag_timestamp", "tag_id", "timestamp"),
+        Index("ix_zone_events_zone_timestamp", "zone_id", "timestamp"),
+    )
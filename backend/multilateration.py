@@ -0,0 +1,159 @@
+from autonav_secrets import RANGE_CALIBRATION_OFFSET, RANGE_CALIBRATION_SCALE, RANGE_MIN, RANGE_MAX, RANGE_MAX_ANCHORS, RANGES_TICK_SECONDS
+from sqlalchemy import select
+import asyncio
+import numpy as np
+import database
+import models
+import stats
+
+# Server-side multilateration of raw UWB ranges.
+#
+# The solver is the one the robots ran locally (robot/main.py,
+# uwb_calculate_coordinates): raw ranges outside (RANGE_MIN, RANGE_MAX) are
+# dropped, the rest are calibrated as (raw - RANGE_CALIBRATION_OFFSET) /
+# RANGE_CALIBRATION_SCALE and projected onto the floor using the anchor
+# height, and the RANGE_MAX_ANCHORS nearest anchors are linearised against
+# the nearest one and solved by least squares (pseudo-inverse).
+#
+# Range sets are queued and solved together once per RANGES_TICK_SECONDS:
+# every set of the tick becomes one row of padded arrays, and the
+# calibration, filtering, sorting and the stacked pseudo-inverses run as
+# NumPy array operations over all rows at once. Anchor positions and
+# heights come from a lookup array built from the anchors table and rebuilt
+# when the anchors collection changes.
+
+solved_sets = stats.counter("range_sets_solved", "Range sets solved into a position.")
+unsolvable_sets = stats.counter("range_sets_unsolvable", "Range sets with fewer than three usable ranges.")
+solver_batches = stats.counter("range_solver_batches", "Vectorized solver runs.")
+
+class AnchorTable:
+    # Anchor address -> row of the positions and heights arrays
+
+    def __init__(self):
+        self.version = None
+        self.index = {}
+        self.positions = np.zeros((0, 2))
+        self.heights = np.zeros(0)
+
+    async def refresh(self, version: int):
+        # version identifies the state of the anchors table; the arrays are
+        # only rebuilt when it changed
+        if version == self.version:
+            return
+
+        async with database.SessionLocal() as db:
+            rows = (await db.execute(select(models.Anchor.address, models.Anchor.pos_x, models.Anchor.pos_y, models.Anchor.height))).all()
+
+        self.index = {address: i for i, (address, _, _, _) in enumerate(rows)}
+        self.positions = np.array([(x, y) for _, x, y, _ in rows], dtype=float).reshape(-1, 2)
+        self.heights = np.array([h for _, _, _, h in rows], dtype=float)
+        self.version = version
+
+def solve(positions: np.ndarray, heights: np.ndarray, indices: np.ndarray, raw: np.ndarray) -> tuple:
+    # indices: (sets, ranges) anchor rows, -1 for padding or unknown anchors
+    # raw: (sets, ranges) raw distances
+    # Returns ((sets, 2) positions, (sets,) bool solved)
+    sets = indices.shape[0]
+    known = indices >= 0
+    rows = np.where(known, indices, 0)
+
+    with np.errstate(invalid="ignore"):
+        valid = known & (raw > RANGE_MIN) & (raw < RANGE_MAX)
+        distance = (raw - RANGE_CALIBRATION_OFFSET) / RANGE_CALIBRATION_SCALE
+        floor2 = distance ** 2 - heights[rows] ** 2 if len(heights) > 0 else np.zeros_like(distance)
+        valid &= floor2 >= 0
+
+    # Nearest anchors first; invalid ranges sort last
+    order = np.argsort(np.where(valid, raw, np.inf), axis=1, kind="stable")[:, :RANGE_MAX_ANCHORS]
+    rows = np.take_along_axis(rows, order, axis=1)
+    valid = np.take_along_axis(valid, order, axis=1)
+    floor = np.sqrt(np.where(valid, np.take_along_axis(floor2, order, axis=1), 0.0))
+
+    solved = valid.sum(axis=1) >= 3
+    result = np.full((sets, 2), np.nan)
+
+    if not solved.any():
+        return result, solved
+
+    anchors = positions[rows] # (sets, k, 2)
+    offset = anchors[:, 0, :]
+    a = anchors[:, 1:, :] - offset[:, None, :]
+    y = 0.5 * ((a ** 2).sum(axis=2) - floor[:, 1:] ** 2 + floor[:, :1] ** 2)
+
+    # Rows of missing ranges are zeroed, which leaves the least squares
+    # solution of the remaining rows unchanged
+    used = valid[:, 1:]
+    a = np.where(used[:, :, None], a, 0.0)
+    y = np.where(used, y, 0.0)
+
+    result[solved] = (np.linalg.pinv(a[solved]) @ y[solved][:, :, None])[:, :, 0] + offset[solved]
+    return result, solved
+
+class RangeSolver:
+
+    def __init__(self, tick: float = RANGES_TICK_SECONDS):
+        self.tick = tick
+        self.anchors = AnchorTable()
+
+        self._queue = [] # (range sets, future)
+        self._handle = None
+
+    def submit(self, range_sets: list) -> asyncio.Future:
+        # range_sets: one list of (anchor address, raw distance) per tag.
+        # The future resolves to one (pos_x, pos_y) or None per set.
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((range_sets, future))
+
+        if self._handle is None:
+            self._handle = loop.call_later(self.tick, self._flush)
+
+        return future
+
+    def _flush(self):
+        self._handle = None
+        queue, self._queue = self._queue, []
+
+        range_sets = [ranges for sets, _ in queue for ranges in sets]
+
+        try:
+            results = self.solve_sets(range_sets)
+        except Exception as e:
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for sets, future in queue:
+            if not future.done():
+                future.set_result(results[start:start + len(sets)])
+            start += len(sets)
+
+    def solve_sets(self, range_sets: list) -> list:
+        if len(range_sets) == 0:
+            return []
+
+        index = self.anchors.index
+        width = max(len(ranges) for ranges in range_sets)
+        indices = np.full((len(range_sets), width), -1, dtype=np.intp)
+        raw = np.full((len(range_sets), width), np.nan)
+
+        for i, ranges in enumerate(range_sets):
+            for j, (address, distance) in enumerate(ranges):
+                indices[i, j] = index.get(address, -1)
+                raw[i, j] = distance
+
+        positions, solved = solve(self.anchors.positions, self.anchors.heights, indices, raw)
+
+        solver_batches.inc()
+        solved_sets.inc(int(solved.sum()))
+        unsolvable_sets.inc(int(len(range_sets) - solved.sum()))
+
+        return [
+            (float(x), float(y)) if ok else None
+            for (x, y), ok in zip(positions.tolist(), solved.tolist())
+        ]
+
+
+solver = RangeSolver()
@@ -0,0 +1,78 @@
+from autonav_secrets import PAGE_MAX_LIMIT
+from fastapi import HTTPException, Response
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List
+import heapq
+import uuid
+
+# Keyset pagination and field projection for the collection endpoints.
+#
+# A page is requested with limit=, cursor= (the id of the last row of the
+# previous page, sent back in the X-Next-Cursor header) and fields= (a comma
+# separated subset of the fields of the Show model). Rows are ordered by id
+# and a page starts right after the cursor, so every page is one index range
+# scan of at most `limit` rows however deep the client is, and only the
+# requested columns are selected. The body keeps the shape of the
+# unpaginated response, minus the fields that were not requested.
+# X-Next-Cursor is absent on the last page.
+
+rows_adapter = TypeAdapter(List[Dict[str, Any]])
+
+class Page:
+    __slots__ = ("fields", "cursor", "limit")
+
+    def __init__(self, fields: list, cursor: uuid.UUID | None, limit: int):
+        self.fields = fields
+        self.cursor = cursor
+        self.limit = limit
+
+def requested(limit: int | None, cursor: uuid.UUID | None, fields: str | None) -> bool:
+    # Without any paging parameter the endpoint answers as before
+    return limit is not None or cursor is not None or fields is not None
+
+def parse(show_model: type[BaseModel], limit: int | None, cursor: uuid.UUID | None, fields: str | None) -> Page:
+    allowed = list(show_model.model_fields)
+
+    if fields is None:
+        selected = allowed
+    else:
+        selected = []
+        for field in fields.split(","):
+            field = field.strip()
+            if field not in allowed:
+                raise HTTPException(status_code=400, detail=f"Unknown field '{field}'; expected any of {', '.join(allowed)}.")
+            if field not in selected:
+                selected.append(field)
+
+    return Page(selected, cursor, limit if limit is not None else PAGE_MAX_LIMIT)
+
+def response(items: list, page: Page) -> Response:
+    # items: up to page.limit + 1 objects ordered by id; the extra one only
+    # tells that another page follows
+    fields = page.fields
+    rows = [{field: getattr(item, field) for field in fields} for item in items[:page.limit]]
+    headers = {}
+
+    if len(items) > page.limit:
+        headers["X-Next-Cursor"] = str(items[page.limit - 1].id)
+
+    return Response(content=rows_adapter.dump_json(rows), media_type="application/json", headers=headers)
+
+async def fetch(db: AsyncSession, model, page: Page) -> Response:
+    # id is always selected for the cursor, even when not returned
+    columns = [model.id] + [getattr(model, field) for field in page.fields if field != "id"]
+    statement = select(*columns).order_by(model.id).limit(page.limit + 1)
+
+    if page.cursor is not None:
+        statement = statement.where(model.id > page.cursor)
+
+    return response((await db.execute(statement)).all(), page)
+
+def from_memory(items, page: Page) -> Response:
+    # Same pages over an in-memory collection, without sorting all of it
+    if page.cursor is not None:
+        items = (item for item in items if item.id > page.cursor)
+
+    return response(heapq.nsmallest(page.limit + 1, items, key=lambda item: item.id), page)
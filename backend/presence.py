@@ -0,0 +1,221 @@
+from autonav_secrets import PRESENCE_STALE_SECONDS, PRESENCE_OFFLINE_SECONDS, PRESENCE_TICK_SECONDS
+from datetime import datetime
+import asyncio
+import math
+import threading
+import time
+import stats
+from tag_store import store, TagEntry
+
+# Online/stale/offline state of every tag, from its last contact.
+#
+# A tag is online until PRESENCE_STALE_SECONDS after its last contact, stale
+# until PRESENCE_OFFLINE_SECONDS after it, and offline after that. Every
+# fix (stored or suppressed) reschedules the tag's next transition in a
+# hashed timer wheel, which costs two dict operations whatever the number
+# of tags; a background task advances the wheel every PRESENCE_TICK_SECONDS
+# and only looks at the slots that came due. Transitions are emitted as
+# events, timestamped when the threshold was crossed, and are emitted at
+# most one tick late.
+#
+# Other subsystems follow changes with add_listener(fn); fn(event) is called
+# with a dict of tag_id, state, previous and timestamp.
+
+ONLINE = "online"
+STALE = "stale"
+OFFLINE = "offline"
+STATES = (ONLINE, STALE, OFFLINE)
+
+presence_changes = stats.counter_family("presence_changes", "Tag presence transitions, by new state.", ("state",))
+
+class TimerWheel:
+    # Each key has at most one deadline; keys due by now are returned by
+    # advance(now). Deadlines are rounded up to whole ticks and hashed into
+    # a slot by tick number, so a slot can hold deadlines of later rounds.
+
+    def __init__(self, tick: float, slots: int, now: float):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)] # key -> deadline tick
+        self._where = {} # key -> slot
+        self._current = math.floor(now / tick) # last tick processed
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key, deadline: float):
+        self.cancel(key)
+
+        due = max(math.ceil(deadline / self.tick), self._current + 1)
+        slot = due % len(self._slots)
+        self._slots[slot][key] = due
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: float) -> list:
+        target = math.floor(now / self.tick)
+        expired = []
+
+        # After a long pause every slot is visited once
+        for i in range(1, min(target - self._current, len(self._slots)) + 1):
+            bucket = self._slots[(self._current + i) % len(self._slots)]
+            due = [key for key, tick in bucket.items() if tick <= target]
+
+            for key in due:
+                del bucket[key]
+                del self._where[key]
+
+            expired += due
+
+        self._current = max(self._current, target)
+        return expired
+
+class PresenceTracker:
+
+    def __init__(self, stale: float = PRESENCE_STALE_SECONDS, offline: float = PRESENCE_OFFLINE_SECONDS, tick: float = PRESENCE_TICK_SECONDS):
+        self.stale = stale
+        self.offline = offline
+        self.tick = tick
+
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick, math.ceil(offline / tick) + 1, time.time())
+        self._seen = {} # tag id -> last contact, seconds since epoch
+        self._state = {} # tag id -> state
+        self._members = {state: set() for state in STATES}
+        self._listeners = []
+
+        self._task = None
+
+    #@@@@@ Listeners
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _emit(self, events: list):
+        for event in events:
+            presence_changes.inc(event["state"])
+            for listener in self._listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    print(f"Presence listener failed: {e}")
+
+    #@@@@@ Tracking
+    def _place(self, tag_id, now: float, events: list):
+        # Sets the state from the age of the last contact and schedules the
+        # next transition
+        seen = self._seen.get(tag_id)
+        age = now - seen if seen is not None else math.inf
+
+        if age < self.stale:
+            state = ONLINE
+            changed = seen
+            self._wheel.schedule(tag_id, seen + self.stale)
+        elif age < self.offline:
+            state = STALE
+            changed = seen + self.stale
+            self._wheel.schedule(tag_id, seen + self.offline)
+        else:
+            state = OFFLINE
+            changed = seen + self.offline if seen is not None else now
+            self._wheel.cancel(tag_id)
+
+        previous = self._state.get(tag_id)
+
+        if previous == state:
+            return
+
+        if previous is not None:
+            self._members[previous].discard(tag_id)
+            events.append({"tag_id": tag_id, "state": state, "previous": previous, "timestamp": datetime.fromtimestamp(changed)})
+
+        self._members[state].add(tag_id)
+        self._state[tag_id] = state
+
+    def listener(self, kind: str, entry: TagEntry):
+        events = []
+
+        with self._lock:
+            if kind == "remove":
+                self._wheel.cancel(entry.id)
+                self._seen.pop(entry.id, None)
+                state = self._state.pop(entry.id, None)
+                if state is not None:
+                    self._members[state].discard(entry.id)
+                return
+
+            if kind == "put" and entry.id in self._state:
+                return
+
+            # last_contact is a naive local time
+            self._seen[entry.id] = entry.last_contact.timestamp() if entry.last_contact is not None else None
+            self._place(entry.id, time.time(), events)
+
+        self._emit(events)
+
+    def expire(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        events = []
+
+        with self._lock:
+            for tag_id in self._wheel.advance(now):
+                self._place(tag_id, now, events)
+
+        self._emit(events)
+        return len(events)
+
+    def load(self):
+        # Initial states emit no events
+        with self._lock:
+            self._wheel = TimerWheel(self.tick, math.ceil(self.offline / self.tick) + 1, time.time())
+            self._seen.clear()
+            self._state.clear()
+            for members in self._members.values():
+                members.clear()
+
+            now = time.time()
+            for entry in store.all():
+                self._seen[entry.id] = entry.last_contact.timestamp() if entry.last_contact is not None else None
+                self._place(entry.id, now, [])
+
+    #@@@@@ Queries
+    def state_of(self, tag_id) -> str:
+        return self._state.get(tag_id, OFFLINE)
+
+    def members(self, state: str) -> list:
+        with self._lock:
+            return list(self._members[state])
+
+    def count(self, state: str) -> int:
+        return len(self._members[state])
+
+    #@@@@@ Background
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"Presence expiry failed: {e}")
+
+    async def start(self):
+        self.load()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+tracker = PresenceTracker()
+store.add_listener(tracker.listener)
+
+for state in STATES:
+    stats.gauge(f"tags_{state}", f"Tags currently {state}.", lambda state=state: tracker.count(state))
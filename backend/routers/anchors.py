@@ -1,12 +1,19 @@
-from fastapi import Depends, HTTPException, APIRouter
+from autonav_secrets import FAST_SERIALIZATION, PAGE_MAX_LIMIT
+from fastapi import Depends, HTTPException, APIRouter, Query, Request
+from pydantic import TypeAdapter
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
 import schemas
 import database
 from . import auth
 import models
 import uuid
+from collection_cache import CollectionCache
+import paging
+import bulk
+from fast_json import RowEncoder
 
 
 router = APIRouter()
@@ -17,6 +24,20 @@ router = APIRouter()
 #                                             
 ###############################################
 
+# Cached /anchors/all body, invalidated by every write below
+anchors_cache = CollectionCache("anchors")
+anchors_adapter = TypeAdapter(List[schemas.AnchorShow])
+anchors_encoder = RowEncoder(schemas.AnchorShow)
+
+async def anchors_serialize_all(db: AsyncSession) -> bytes:
+    # Fast path: plain column tuples, encoded without per-row models
+    if FAST_SERIALIZATION:
+        rows = await db.execute(select(*[getattr(models.Anchor, field) for field in anchors_encoder.fields]))
+        return anchors_encoder.encode_rows(rows)
+
+    anchors = (await db.scalars(select(models.Anchor))).all()
+    return anchors_adapter.dump_json(anchors_adapter.validate_python(anchors, from_attributes=True))
+
 ###############################################
 #                                             
 #               GET Operations                
@@ -26,29 +47,46 @@ router = APIRouter()
 # User ============== GET Anchor: All
 @router.get("/all", response_model=List[schemas.AnchorShow])
 async def anchors_get_all(
-    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    request: Request,
+    requester: Annotated[schemas.UserShow | str, Depends(auth.authenticate_token_or_device)],
+    limit: Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT)] = None,
+    cursor: uuid.UUID | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(database.get)
 ):
-    anchors = []
+    # Paged and projected reads go straight to the table
+    if paging.requested(limit, cursor, fields):
+        page = paging.parse(schemas.AnchorShow, limit, cursor, fields)
+
+        try:
+            return await paging.fetch(db, models.Anchor, page)
+        except:
+            raise HTTPException(status_code=500)
 
     try:
-        anchors = db.query(models.Anchor).all()
+        return await anchors_cache.response(request, lambda: anchors_serialize_all(db))
     except:
         raise HTTPException(status_code=500)
 
-    return anchors
+# User ============== GET Anchor: Export all (JSON or CSV), streamed
+@router.get("/export")
+async def anchors_get_export(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    format: str = "json"
+):
+    return bulk.export_response(models.Anchor, schemas.AnchorShow, format, "anchors")
 
 # User ============== GET Anchor: Single by UUID
 @router.get("/{anchor_id}", response_model=schemas.AnchorShow)
 async def anchors_get_single(
     anchor_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     anchor = None
 
     # Check for anchor by UUID
-    anchor = db.query(models.Anchor).filter(models.Anchor.id == uuid.UUID(anchor_id)).first()
+    anchor = await db.scalar(select(models.Anchor).where(models.Anchor.id == uuid.UUID(anchor_id)))
 
 
     if anchor is None:
@@ -67,7 +105,7 @@ async def anchors_get_single(
 async def anchors_post_create(
     anchor_in: schemas.AnchorBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -85,16 +123,46 @@ async def anchors_post_create(
     db.add(db_anchor)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(status_code=409, detail="An anchor with this name or address already exists.")
     except:
         raise HTTPException(status_code=500)
 
-    db.refresh(db_anchor)
+    anchors_cache.bump()
+
+    await db.refresh(db_anchor)
 
     return db_anchor
 
+# Admin ============= POST Anchor: Bulk import (JSON array or CSV)
+@router.post("/bulk", response_model=List[schemas.BulkRowStatus])
+async def anchors_post_bulk(
+    request: Request,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    upsert: bool = False,
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    # Fails with 422 before anything is written if any row is invalid
+    items = await bulk.read_rows(request, schemas.AnchorBulkItem)
+
+    try:
+        statuses, written = await bulk.write_rows(db, models.Anchor, items, ("address", "name"), upsert)
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The import collided with a concurrent change; nothing was written.")
+    except:
+        raise HTTPException(status_code=500)
+
+    if len(written) > 0:
+        anchors_cache.bump()
+
+    return statuses
+
 ###############################################
 #                                             
 #              PATCH Operations               
@@ -107,7 +175,7 @@ async def anchors_patch_single(
     anchor_id: str,
     anchor_in: schemas.AnchorBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Requires Admin
     if requester.role != 1:
@@ -117,7 +185,7 @@ async def anchors_patch_single(
 
     # Check for anchor by UUID
     try:
-        anchor = db.query(models.Anchor).filter(models.Anchor.id == uuid.UUID(anchor_id)).first()
+        anchor = await db.scalar(select(models.Anchor).where(models.Anchor.id == uuid.UUID(anchor_id)))
     except:
         pass
 
@@ -130,10 +198,12 @@ async def anchors_patch_single(
         anchor.height = anchor_in.height
         anchor.pos_x = anchor_in.pos_x
         anchor.pos_y = anchor_in.pos_y
-        db.commit()
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
+    anchors_cache.bump()
+
     return anchor
 
 # Admin ============= PATCH Anchor: Single Position Only
@@ -142,7 +212,7 @@ async def anchors_patch_single_position(
     anchor_id: str,
     anchor_in: schemas.AnchorPosition,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Requires Admin
     if requester.role != 1:
@@ -152,7 +222,7 @@ async def anchors_patch_single_position(
 
     # Check for anchor by UUID
     try:
-        anchor = db.query(models.Anchor).filter(models.Anchor.id == uuid.UUID(anchor_id)).first()
+        anchor = await db.scalar(select(models.Anchor).where(models.Anchor.id == uuid.UUID(anchor_id)))
     except:
         pass
 
@@ -162,10 +232,12 @@ async def anchors_patch_single_position(
     try:
         anchor.pos_x = anchor_in.pos_x
         anchor.pos_y = anchor_in.pos_y
-        db.commit()
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
+    anchors_cache.bump()
+
     return anchor
 
 ###############################################
@@ -179,7 +251,7 @@ async def anchors_patch_single_position(
 async def anchors_delete_single(
     anchor_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -189,7 +261,7 @@ async def anchors_delete_single(
 
     # Check for anchor by UUID
     try:
-        anchor = db.query(models.Anchor).filter(models.Anchor.id == uuid.UUID(anchor_id)).first()
+        anchor = await db.scalar(select(models.Anchor).where(models.Anchor.id == uuid.UUID(anchor_id)))
     except:
         pass
 
@@ -198,9 +270,11 @@ async def anchors_delete_single(
         raise HTTPException(status_code=404, detail="An anchor with that ID does not exist.")
     
     try:
-        db.delete(anchor)
-        db.commit()
+        await db.delete(anchor)
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
+    anchors_cache.bump()
+
     return anchor
\ No newline at end of file
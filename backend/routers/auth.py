@@ -1,22 +1,69 @@
+import asyncio
 import bcrypt
 import jwt
 from typing import Annotated
 from datetime import datetime, timedelta, timezone
-from autonav_secrets import JWT_SECRET, JWT_ALGORITHM, JWT_TOKEN_EXPIRE_MINUTES
+from autonav_secrets import JWT_SECRET, JWT_ALGORITHM, JWT_TOKEN_EXPIRE_MINUTES, PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS, PASSWORD_HASH_WORKERS, DEVICE_TOKENS_REQUIRED
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, Response
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestFormStrict
-from sqlalchemy.orm import Session
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer, OAuth2PasswordRequestFormStrict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 import database
 import schemas
 import models
+import stats
+import time
+import device_auth
 
 router = APIRouter()
 
 # Define OAuth2 Parameters
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="v1/token")
 
+# Device tokens (device_auth.py) are sent as a plain bearer token
+device_scheme = HTTPBearer(auto_error=False)
+
+# Resolved principals by username (the token 'sub'), so authenticated
+# requests skip the users lookup. Tokens are still decoded and checked on
+# every request; entries expire after PRINCIPAL_CACHE_TTL_SECONDS and the
+# users router invalidates them when a user is edited or deleted.
+class PrincipalCache:
+
+  def __init__(self, max_size: int, ttl: float):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._entries = OrderedDict()
+    self.hits = stats.counter("auth_principal_cache_hits", "Authenticated requests served from the principal cache.")
+    self.misses = stats.counter("auth_principal_cache_misses", "Authenticated requests that looked the user up in the database.")
+
+  def get(self, username: str) -> schemas.UserShow | None:
+    entry = self._entries.get(username)
+
+    if entry is None or entry[0] < time.monotonic():
+      self.misses.inc()
+      return None
+
+    self._entries.move_to_end(username)
+    self.hits.inc()
+    return entry[1]
+
+  def put(self, username: str, user: schemas.UserShow):
+    self._entries[username] = (time.monotonic() + self.ttl, user)
+    self._entries.move_to_end(username)
+
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def invalidate(self, *usernames: str):
+    for username in usernames:
+      self._entries.pop(username, None)
+
+principals = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+
 def str_to_bits(*args):
     return tuple(s.encode('utf-8') for s in args)
 
@@ -30,6 +77,19 @@ def hash_password(plaintext_password: str) -> str:
 def verify_password(plaintext_password: str, hashed_password: str) -> bool:
   return bcrypt.checkpw(*str_to_bits(plaintext_password, hashed_password))
 
+# bcrypt takes hundreds of milliseconds per call, so request handlers run it
+# on a dedicated pool of PASSWORD_HASH_WORKERS threads instead of the event
+# loop. Logins beyond that limit queue here without stalling other requests.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+async def hash_password_async(plaintext_password: str) -> str:
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(password_executor, hash_password, plaintext_password)
+
+async def verify_password_async(plaintext_password: str, hashed_password: str) -> bool:
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(password_executor, verify_password, plaintext_password, hashed_password)
+
 def create_token(data: dict, expires_delta: timedelta | None = None):
   to_encode = data.copy()
 
@@ -54,14 +114,14 @@ def decode_token(token: str):
 async def token_get(
     response: Response,
     form_data: Annotated[OAuth2PasswordRequestFormStrict, Depends()],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ): 
     # Check for user by username
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    user = await db.scalar(select(models.User).where(models.User.username == form_data.username))
 
     # If no results, try looking up user by email
     if user is None:
-        user = db.query(models.User).filter(models.User.email == form_data.username).first()
+        user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
 
 
     if user is None:
@@ -70,7 +130,7 @@ async def token_get(
     if user.disabled:
         raise HTTPException(status_code=403, detail="This account is disabled.", headers={"WWW_Authenticate": "Bearer"})
 
-    if not verify_password(form_data.password, user.hashed_password):
+    if not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid credentials.", headers={"WWW_Authenticate": "Bearer"})
 
     expiration = timedelta(minutes=JWT_TOKEN_EXPIRE_MINUTES)
@@ -97,9 +157,32 @@ async def token_get(
 
     return ret
 
+async def user_from_token(token: str, db: AsyncSession):
+    try:
+        payload = decode_token(str(token))
+        username: str = payload.get("sub")
+    except:
+        return None
+
+    if username is None:
+        return None
+
+    user = principals.get(username)
+
+    if user is None:
+        user = await db.scalar(select(models.User).where(models.User.username == username))
+
+        if user is None:
+            return None
+
+        user = schemas.UserShow.model_validate(user, from_attributes=True)
+        principals.put(username, user)
+
+    return user
+
 async def authenticate_token(
     token: Annotated[str, Depends(oauth2_scheme)], 
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     creds_exception = HTTPException(
         status_code=401,
@@ -107,15 +190,7 @@ async def authenticate_token(
         headers={"WWW-Authenticate": "Bearer"}
     )
 
-    try:
-        payload = decode_token(str(token))
-        username: str = payload.get("sub")
-        if username is None:
-            raise creds_exception
-    except:
-        raise creds_exception
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = await user_from_token(token, db)
 
     if user is None:
         raise creds_exception
@@ -123,4 +198,35 @@ async def authenticate_token(
     if user.disabled:
         raise HTTPException(status_code=400, detail="This account is disabled.", headers={"WWW_Authenticate": "Bearer"})
     
-    return user
\ No newline at end of file
+    return user
+
+async def authenticate_device(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(device_scheme)]
+) -> str | None:
+    # Returns the tag address the device token is bound to; None when
+    # device tokens are not required. Never touches the database.
+    if not DEVICE_TOKENS_REQUIRED:
+        return None
+
+    address = device_auth.verifier.verify(credentials.credentials) if credentials is not None else None
+
+    if address is None:
+        raise HTTPException(status_code=401, detail="Missing, invalid, or revoked device token.", headers={"WWW-Authenticate": "Bearer"})
+
+    return address
+
+async def authenticate_token_or_device(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(database.get)
+):
+    # For reads robots need too: a device token is accepted in place of a
+    # user token. Returns the user, or the tag address of the device.
+    if device_auth.is_device_token(token):
+        address = device_auth.verifier.verify(token)
+
+        if address is None:
+            raise HTTPException(status_code=401, detail="Missing, invalid, or revoked device token.", headers={"WWW-Authenticate": "Bearer"})
+
+        return address
+
+    return await authenticate_token(token, db)
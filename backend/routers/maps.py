@@ -0,0 +1,259 @@
+from autonav_secrets import MAP_MAX_IMAGE_BYTES
+from fastapi import Depends, HTTPException, APIRouter, Request, Response
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, List
+import asyncio
+import os
+import re
+import schemas
+import database
+from . import auth
+import models
+import uuid
+import map_tiles
+import stats
+
+
+router = APIRouter()
+
+###############################################
+#                                             
+#              Helper Functions               
+#                                             
+###############################################
+
+# Tile URLs change with every upload, so tiles never need revalidation
+TILE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+TILES_VERSION = re.compile(r"[0-9a-f]{16}")
+
+tiles_served = stats.counter("map_tiles_served", "Map tiles served.")
+
+def maps_remove_tiles(map_id, tiles_version: str | None):
+    if tiles_version is None:
+        return
+
+    path = map_tiles.archive_path(map_id, tiles_version)
+    map_tiles.archives.discard(path)
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def maps_get_or_404(db: AsyncSession, map_id: str) -> models.Map:
+    db_map = None
+
+    # Check for map by UUID
+    try:
+        db_map = await db.scalar(select(models.Map).where(models.Map.id == uuid.UUID(map_id)))
+    except:
+        pass
+
+    if db_map is None:
+        raise HTTPException(status_code=404, detail="A map with that ID does not exist.")
+
+    return db_map
+
+###############################################
+#                                             
+#               GET Operations                
+#                                             
+###############################################
+
+# User ============== GET Map: All
+@router.get("/all", response_model=List[schemas.MapShow])
+async def maps_get_all(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    maps = []
+
+    try:
+        maps = (await db.scalars(select(models.Map).order_by(models.Map.site, models.Map.floor))).all()
+    except:
+        raise HTTPException(status_code=500)
+
+    return maps
+
+# User ============== GET Map: Single by UUID
+@router.get("/{map_id}", response_model=schemas.MapShow)
+async def maps_get_single(
+    map_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    return await maps_get_or_404(db, map_id)
+
+# Public ============ GET Map: Tile of the pyramid
+# Image elements cannot send the bearer token; the URL carries the hash of
+# the uploaded image, so it cannot be guessed without reading the map first
+@router.get("/{map_id}/tiles/{tiles_version}/{z}/{x}/{y}.png")
+async def maps_get_tile(
+    map_id: uuid.UUID,
+    tiles_version: str,
+    z: int,
+    x: int,
+    y: int
+):
+    tile = None
+
+    if TILES_VERSION.fullmatch(tiles_version) is not None:
+        archive = map_tiles.archives.get(map_tiles.archive_path(map_id, tiles_version))
+        if archive is not None:
+            tile = archive.tile(z, x, y)
+
+    if tile is None:
+        raise HTTPException(status_code=404, detail="No such tile.")
+
+    tiles_served.inc()
+
+    return Response(content=tile, media_type="image/png", headers=TILE_HEADERS)
+
+###############################################
+#                                             
+#               POST Operations               
+#                                             
+###############################################
+
+# Admin ============= POST Map: Create
+@router.post("", response_model=schemas.MapShow, status_code=201)
+async def maps_post_create(
+    map_in: schemas.MapBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    db_map = models.Map(
+        id = uuid.uuid4(),
+        site = map_in.site,
+        floor = map_in.floor,
+        name = map_in.name,
+        pixels_per_metre = map_in.pixels_per_metre,
+        origin_x = map_in.origin_x,
+        origin_y = map_in.origin_y
+    )
+
+    db.add(db_map)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A map for this site and floor already exists.")
+    except:
+        raise HTTPException(status_code=500)
+
+    await db.refresh(db_map)
+
+    return db_map
+
+###############################################
+#                                             
+#              PATCH Operations               
+#                                             
+###############################################
+
+# Admin ============= PATCH Map: Single
+@router.patch("/{map_id}", response_model=schemas.MapShow)
+async def maps_patch_single(
+    map_id: str,
+    map_in: schemas.MapBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Requires Admin
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    db_map = await maps_get_or_404(db, map_id)
+
+    try:
+        db_map.site = map_in.site
+        db_map.floor = map_in.floor
+        db_map.name = map_in.name
+        db_map.pixels_per_metre = map_in.pixels_per_metre
+        db_map.origin_x = map_in.origin_x
+        db_map.origin_y = map_in.origin_y
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A map for this site and floor already exists.")
+    except:
+        raise HTTPException(status_code=500)
+
+    return db_map
+
+# Admin ============= PUT Map: Floor plan image, cut into tiles
+@router.put("/{map_id}/image", response_model=schemas.MapShow)
+async def maps_put_image(
+    map_id: str,
+    request: Request,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Requires Admin
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    db_map = await maps_get_or_404(db, map_id)
+
+    data = await request.body()
+
+    if len(data) > MAP_MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"The image may be at most {MAP_MAX_IMAGE_BYTES} bytes.")
+
+    tiles_version = map_tiles.image_version(data)
+    previous = db_map.tiles_version
+
+    # The pyramid is generated once per image, off the event loop
+    try:
+        width, height, levels = await asyncio.to_thread(map_tiles.build_archive, data, map_tiles.archive_path(db_map.id, tiles_version))
+    except:
+        raise HTTPException(status_code=400, detail="The body is not a supported image.")
+
+    try:
+        db_map.width = width
+        db_map.height = height
+        db_map.tile_size = map_tiles.MAP_TILE_SIZE
+        db_map.levels = levels
+        db_map.tiles_version = tiles_version
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    if previous != tiles_version:
+        maps_remove_tiles(db_map.id, previous)
+
+    return db_map
+
+###############################################
+#                                             
+#              DELETE Operations              
+#                                             
+###############################################
+
+# Admin ============= Delete Map: Single
+@router.delete("/{map_id}", response_model=schemas.MapShow)
+async def maps_delete_single(
+    map_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    db_map = await maps_get_or_404(db, map_id)
+
+    try:
+        await db.delete(db_map)
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    maps_remove_tiles(db_map.id, db_map.tiles_version)
+
+    return db_map
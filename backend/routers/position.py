@@ -1,38 +1,185 @@
-from fastapi import Depends, HTTPException, APIRouter, Request
-from sqlalchemy.orm import Session
+from autonav_secrets import STREAM_MAX_RATE_HZ, STREAM_MAX_PENDING
+from datetime import datetime
+from fastapi import Depends, HTTPException, APIRouter, Request, WebSocket, WebSocketException
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
+from broadcast import Broadcaster
 import schemas
 import database
-import models
-import time
+from . import auth
+from . import anchors
+from tag_store import store, TagEntry
+import json
+import multilateration
 
 
 router = APIRouter()
 
+###############################################
+#                                             
+#              Helper Functions               
+#                                             
+###############################################
+
+# Live tag changes for /position/stream subscribers
+tag_stream = Broadcaster(max_rate=STREAM_MAX_RATE_HZ, max_pending=STREAM_MAX_PENDING)
+
+def tag_message(kind: str, entry: TagEntry) -> str:
+    if kind == "remove":
+        return json.dumps({"id": str(entry.id), "deleted": True})
+
+    return json.dumps({
+        "id": str(entry.id),
+        "name": entry.name,
+        "address": entry.address,
+        "pos_x": entry.pos_x,
+        "pos_y": entry.pos_y,
+        "last_contact": entry.last_contact.isoformat() if entry.last_contact is not None else None
+    })
+
+def publish_tag(kind: str, entry: TagEntry):
+    # Suppressed fixes did not move the tag
+    if kind == "contact" or tag_stream.subscriber_count == 0:
+        return
+
+    tag_stream.publish(entry.id, tag_message(kind, entry))
+
+store.add_listener(publish_tag)
+
+###############################################
+#                                             
+#               POST Operations               
+#                                             
+###############################################
+
 # POST position
-@router.post("")
+@router.post("", response_model=schemas.TagShow)
 async def post_position(
     data_in: schemas.TagPosition,
-    db: Session = Depends(database.get)
+    device: Annotated[str | None, Depends(auth.authenticate_device)]
 ):
-    tag = None
+    # A device may only post its own position
+    if device is not None and data_in.address != device:
+        raise HTTPException(status_code=403, detail="The device token is bound to another tag.")
 
-    # Check for tag by UUID
-    try:
-        tag = db.query(models.Tag).filter(models.Tag.address == data_in.address).first()
-    except:
-        pass
+    tag, _ = store.update_position(data_in.address, data_in.pos_x, data_in.pos_y, datetime.now())
 
-    # A tag is not found with the given uuid
+    # A tag is not found with the given address
     if tag is None:
         raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
 
+    return tag
+
+# POST position: Batch of fixes for many tags
+@router.post("/batch", response_model=List[schemas.TagPositionStatus])
+async def post_position_batch(
+    data_in: List[schemas.TagPositionBatchItem],
+    device: Annotated[str | None, Depends(auth.authenticate_device)]
+):
+    received = datetime.now()
+    statuses = []
+
+    # Fixes land in the tag store; the newest fix per tag is persisted with
+    # a single bulk UPDATE on the next flush
+    for item in data_in:
+        if device is not None and item.address != device:
+            statuses.append(schemas.TagPositionStatus(address=item.address, status="forbidden"))
+            continue
+
+        tag, applied = store.update_position(item.address, item.pos_x, item.pos_y, item.timestamp or received)
+
+        if tag is None:
+            status = "not_found"
+        elif applied:
+            status = "updated"
+        else:
+            status = "superseded"
+
+        statuses.append(schemas.TagPositionStatus(address=item.address, status=status))
+
+    return statuses
+
+# POST position: Raw anchor ranges, solved on the server
+@router.post("/ranges", response_model=List[schemas.TagRangesStatus])
+async def post_position_ranges(
+    data_in: List[schemas.TagRanges],
+    device: Annotated[str | None, Depends(auth.authenticate_device)]
+):
+    received = datetime.now()
+
+    # Rebuilds the anchor lookup arrays if anchors changed since the last call
     try:
-        tag.pos_x = data_in.pos_x
-        tag.pos_y = data_in.pos_y
-        tag.last_contact = time.strftime('%Y-%m-%d %H:%M:%S')
-        db.commit()
+        await multilateration.solver.anchors.refresh(anchors.anchors_cache.version)
     except:
         raise HTTPException(status_code=500)
 
-    return tag
\ No newline at end of file
+    allowed = [item for item in data_in if device is None or item.address == device]
+    known = [item for item in allowed if store.get_by_address(item.address) is not None]
+
+    # Solved together with every other set received in the same tick
+    positions = await multilateration.solver.submit([
+        [(r.anchor, r.distance) for r in item.ranges]
+        for item in known
+    ])
+    solved = {id(item): position for item, position in zip(known, positions)}
+
+    statuses = []
+
+    for item in data_in:
+        position = solved.get(id(item))
+
+        if device is not None and item.address != device:
+            statuses.append(schemas.TagRangesStatus(address=item.address, status="forbidden"))
+            continue
+
+        if id(item) not in solved:
+            statuses.append(schemas.TagRangesStatus(address=item.address, status="not_found"))
+            continue
+
+        if position is None:
+            statuses.append(schemas.TagRangesStatus(address=item.address, status="unsolvable"))
+            continue
+
+        # The fix is as recent as its latest range
+        timestamp = max((r.timestamp for r in item.ranges if r.timestamp is not None), default=received)
+        tag, applied = store.update_position(item.address, position[0], position[1], timestamp)
+
+        if tag is None:
+            status = "not_found"
+        elif applied:
+            status = "updated"
+        else:
+            status = "superseded"
+
+        statuses.append(schemas.TagRangesStatus(address=item.address, status=status, pos_x=position[0], pos_y=position[1]))
+
+    return statuses
+
+###############################################
+#                                             
+#             WebSocket Operations            
+#                                             
+###############################################
+
+# User ============== WS Position: Live stream of changed tags
+@router.websocket("/stream")
+async def position_stream(
+    websocket: WebSocket,
+    token: str,
+    db: AsyncSession = Depends(database.get)
+):
+    # Browsers cannot set headers on a websocket, so the token is a query parameter
+    user = await auth.user_from_token(token, db)
+    await db.close()
+
+    if user is None or user.disabled:
+        raise WebSocketException(code=1008, reason="Missing, invalid, or expired token.")
+
+    await websocket.accept()
+
+    # Start with the full current state, then only changes
+    subscriber = tag_stream.subscribe()
+    for entry in store.all():
+        subscriber.offer(entry.id, tag_message("put", entry))
+
+    await tag_stream.serve(websocket, subscriber)
@@ -1,12 +1,29 @@
-from fastapi import Depends, HTTPException, APIRouter
+from autonav_secrets import FAST_SERIALIZATION, HISTORY_MAX_POINTS, PAGE_MAX_LIMIT, SPATIAL_COORDINATE_LIMIT, STREAM_MAX_RATE_HZ, STREAM_MAX_PENDING, TAGS_ALL_CACHE_SECONDS
+from datetime import datetime, timedelta
+from fastapi import Depends, HTTPException, APIRouter, Query, Response, WebSocket, WebSocketException
+from pydantic import TypeAdapter
+from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
 import schemas
 import database
 from . import auth
 import models
 import uuid
+from tag_store import store, naive_local
+from broadcast import Broadcaster
+import history
+import spatial
+import geofence
+import presence
+import changes
+import device_auth
+import paging
+import itertools
+import json
+from fast_json import RowEncoder
+from collection_cache import MicroCache
 
 
 router = APIRouter()
@@ -17,6 +34,68 @@ router = APIRouter()
 #                                             
 ###############################################
 
+# Encodes /tags/all without a TagShow per tag when FAST_SERIALIZATION is set
+tags_encoder = RowEncoder(schemas.TagShow)
+tags_adapter = TypeAdapter(List[schemas.TagShow])
+
+# One /tags/all body shared by every poller for TAGS_ALL_CACHE_SECONDS
+tags_all_cache = MicroCache("tags_all", TAGS_ALL_CACHE_SECONDS)
+
+def tags_serialize_all() -> bytes:
+    if FAST_SERIALIZATION:
+        return tags_encoder.encode_objects(store.all())
+
+    return tags_adapter.dump_json(tags_adapter.validate_python(store.all(), from_attributes=True))
+
+# Presence changes for /tags/presence subscribers. Every change gets its own
+# key so changes are never coalesced away.
+presence_stream = Broadcaster(max_rate=STREAM_MAX_RATE_HZ, max_pending=STREAM_MAX_PENDING)
+presence_event_keys = itertools.count()
+
+def presence_message(event: dict) -> str:
+    return json.dumps({
+        "tag_id": str(event["tag_id"]),
+        "state": event["state"],
+        "previous": event["previous"],
+        "timestamp": event["timestamp"].isoformat()
+    })
+
+def publish_presence(event: dict):
+    if presence_stream.subscriber_count == 0:
+        return
+
+    presence_stream.publish(next(presence_event_keys), presence_message(event))
+
+presence.tracker.add_listener(publish_presence)
+
+async def tags_revoke_credentials(db: AsyncSession, tag_id) -> list:
+    # Revokes every live credential of the tag in the current transaction;
+    # pass the returned ids to device_auth.verifier.revoke after the commit
+    ids = (await db.scalars(
+        select(models.DeviceCredential.id)
+        .where(models.DeviceCredential.tag_id == tag_id, models.DeviceCredential.revoked == False)
+    )).all()
+
+    if len(ids) > 0:
+        await db.execute(update(models.DeviceCredential).where(models.DeviceCredential.id.in_(ids)).values(revoked=True))
+
+    return ids
+
+def tags_parse_bbox(bbox: str) -> tuple:
+    # "min_x,min_y,max_x,max_y"
+    try:
+        min_x, min_y, max_x, max_y = (float(v) for v in bbox.split(","))
+    except:
+        raise HTTPException(status_code=400, detail="bbox must be 'min_x,min_y,max_x,max_y'.")
+
+    if not all(abs(v) <= SPATIAL_COORDINATE_LIMIT for v in (min_x, min_y, max_x, max_y)):
+        raise HTTPException(status_code=400, detail=f"bbox coordinates must be finite and within {SPATIAL_COORDINATE_LIMIT}.")
+
+    if min_x > max_x or min_y > max_y:
+        raise HTTPException(status_code=400, detail="bbox minimums must not exceed its maximums.")
+
+    return min_x, min_y, max_x, max_y
+
 ###############################################
 #                                             
 #               GET Operations                
@@ -27,28 +106,123 @@ router = APIRouter()
 @router.get("/all", response_model=List[schemas.TagShow])
 async def tags_get_all(
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    limit: Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT)] = None,
+    cursor: uuid.UUID | None = None,
+    fields: str | None = None
 ):
+    # Tags are served from the store, so pages are cut from memory
+    if paging.requested(limit, cursor, fields):
+        return paging.from_memory(store.all(), paging.parse(schemas.TagShow, limit, cursor, fields))
+
+    if TAGS_ALL_CACHE_SECONDS > 0:
+        try:
+            return Response(content=tags_all_cache.get(tags_serialize_all), media_type="application/json")
+        except:
+            raise HTTPException(status_code=500)
+
+    # Fast path: encode the store entries directly, same output as TagShow
+    if FAST_SERIALIZATION:
+        return Response(content=tags_encoder.encode_objects(store.all()), media_type="application/json")
+
     tags = []
 
     try:
-        tags = db.query(models.Tag).all()
+        tags = store.all()
     except:
         raise HTTPException(status_code=500)
 
     return tags
 
+# User ============== GET Tag: All inside a bounding box
+@router.get("/within", response_model=List[schemas.TagShow])
+async def tags_get_within(
+    bbox: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
+):
+    return spatial.tags.within(*tags_parse_bbox(bbox))
+
+# User ============== GET Tag: All within a radius, closest first
+@router.get("/near", response_model=List[schemas.TagNear])
+async def tags_get_near(
+    x: Annotated[float, Query(ge=-SPATIAL_COORDINATE_LIMIT, le=SPATIAL_COORDINATE_LIMIT, allow_inf_nan=False)],
+    y: Annotated[float, Query(ge=-SPATIAL_COORDINATE_LIMIT, le=SPATIAL_COORDINATE_LIMIT, allow_inf_nan=False)],
+    r: Annotated[float, Query(ge=0, le=SPATIAL_COORDINATE_LIMIT, allow_inf_nan=False)],
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
+):
+    return [
+        schemas.TagNear(**schemas.TagShow.model_validate(tag, from_attributes=True).model_dump(), distance=distance)
+        for distance, tag in spatial.tags.near(x, y, r)
+    ]
+
+# User ============== GET Tag: All currently online (and optionally stale)
+@router.get("/active", response_model=List[schemas.TagPresence])
+async def tags_get_active(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    stale: bool = False
+):
+    states = (presence.ONLINE, presence.STALE) if stale else (presence.ONLINE,)
+    tags = []
+
+    for state in states:
+        for tag_id in presence.tracker.members(state):
+            tag = store.get(tag_id)
+            if tag is not None:
+                tags.append(schemas.TagPresence(**schemas.TagShow.model_validate(tag, from_attributes=True).model_dump(), state=state))
+
+    return tags
+
+# User ============== GET Tag: All seen since a time, most recent first
+@router.get("/seen", response_model=List[schemas.TagShow])
+async def tags_get_seen(
+    since: datetime,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Reads the persisted last_contact, which trails the live value by up
+    # to the flush interval (or the heartbeat for a parked tag)
+    try:
+        return (await db.scalars(
+            select(models.Tag)
+            .where(models.Tag.last_contact >= naive_local(since))
+            .order_by(models.Tag.last_contact.desc())
+        )).all()
+    except:
+        raise HTTPException(status_code=500)
+
+# User ============== GET Tag: Changed since a cursor of the change feed
+@router.get("/changes", response_model=schemas.TagChanges)
+async def tags_get_changes(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    since: str | None = None
+):
+    # Without a usable cursor the client gets every tag
+    cursor, changed = changes.feed.since(since)
+
+    if changed is None:
+        return schemas.TagChanges(cursor=cursor, resync=True, tags=[schemas.TagShow.model_validate(tag, from_attributes=True) for tag in store.all()])
+
+    tags = []
+    deleted = []
+
+    for tag_id in changed:
+        tag = store.get(tag_id)
+        if tag is None:
+            deleted.append(tag_id)
+        else:
+            tags.append(schemas.TagShow.model_validate(tag, from_attributes=True))
+
+    return schemas.TagChanges(cursor=cursor, resync=False, tags=tags, deleted=deleted)
+
 # User ============== GET Tag: Single by UUID
 @router.get("/{tag_id}", response_model=schemas.TagShow)
 async def tags_get_single(
     tag_id: str,
-    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
 ):
     tag = None
 
     # Check for tag by UUID
-    tag = db.query(models.Tag).filter(models.Tag.id == uuid.UUID(tag_id)).first()
+    tag = store.get(uuid.UUID(tag_id))
 
 
     if tag is None:
@@ -56,6 +230,96 @@ async def tags_get_single(
     
     return tag
 
+# User ============== GET Tag: Zones the tag is currently inside
+@router.get("/{tag_id}/zones", response_model=List[uuid.UUID])
+async def tags_get_zones(
+    tag_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
+):
+    tag = None
+
+    try:
+        tag = store.get(uuid.UUID(tag_id))
+    except:
+        pass
+
+    if tag is None:
+        raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
+
+    return list(geofence.engine.zones_of(tag.id))
+
+# Admin ============= GET Tag: Device credentials
+@router.get("/{tag_id}/credentials", response_model=List[schemas.DeviceCredentialShow])
+async def tags_get_credentials(
+    tag_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    tag = None
+
+    try:
+        tag = store.get(uuid.UUID(tag_id))
+    except:
+        pass
+
+    if tag is None:
+        raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
+
+    try:
+        return (await db.scalars(select(models.DeviceCredential).where(models.DeviceCredential.tag_id == tag.id).order_by(models.DeviceCredential.created_at))).all()
+    except:
+        raise HTTPException(status_code=500)
+
+# User ============== GET Tag: Downsampled position history
+@router.get("/{tag_id}/history", response_model=List[schemas.TagHistoryPoint])
+async def tags_get_history(
+    tag_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    start: Annotated[datetime | None, Query(alias="from")] = None,
+    end: Annotated[datetime | None, Query(alias="to")] = None,
+    resolution: Annotated[float | None, Query(gt=0)] = None,
+    db: AsyncSession = Depends(database.get)
+):
+    tag = None
+
+    try:
+        tag = store.get(uuid.UUID(tag_id))
+    except:
+        pass
+
+    if tag is None:
+        raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
+
+    # Defaults to the last hour
+    end = naive_local(end) if end is not None else datetime.now()
+    start = naive_local(start) if start is not None else end - timedelta(hours=1)
+
+    span = (end - start).total_seconds()
+
+    if span <= 0:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'.")
+
+    # Without a resolution, aim for about 1000 points
+    if resolution is None:
+        resolution = max(round(span / 1000), 1)
+
+    if span / resolution > HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {HISTORY_MAX_POINTS} points can be returned; increase 'resolution'.")
+
+    try:
+        points = await history.query(db, tag.id, start, end, resolution)
+    except:
+        raise HTTPException(status_code=500)
+
+    return [
+        schemas.TagHistoryPoint(timestamp=t, pos_x=x, pos_y=y, samples=n)
+        for t, x, y, n in points
+    ]
+
 ###############################################
 #                                             
 #               POST Operations               
@@ -67,7 +331,7 @@ async def tags_get_single(
 async def tags_post_create(
     tag_in: schemas.TagBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -85,16 +349,64 @@ async def tags_post_create(
     db.add(db_tag)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(status_code=409, detail="A tag with this name or address already exists.")
     except:
         raise HTTPException(status_code=500)
 
-    db.refresh(db_tag)
+    await db.refresh(db_tag)
+    store.put(db_tag)
 
     return db_tag
 
+# Admin ============= POST Tag: Issue a device credential
+@router.post("/{tag_id}/credentials", response_model=schemas.DeviceCredentialToken, status_code=201)
+async def tags_post_credential(
+    tag_id: str,
+    credential_in: schemas.DeviceCredentialBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    tag = None
+
+    try:
+        tag = store.get(uuid.UUID(tag_id))
+    except:
+        pass
+
+    if tag is None:
+        raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
+
+    if not device_auth.configured:
+        raise HTTPException(status_code=503, detail="Device tokens are disabled: DEVICE_TOKEN_SECRET is not set.")
+
+    db_credential = models.DeviceCredential(
+        id = uuid.uuid4(),
+        tag_id = tag.id,
+        address = tag.address,
+        name = credential_in.name,
+        created_at = datetime.now(),
+        revoked = False
+    )
+
+    db.add(db_credential)
+
+    try:
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    # The token is not stored; it can only be read here
+    return schemas.DeviceCredentialToken(
+        **schemas.DeviceCredentialShow.model_validate(db_credential, from_attributes=True).model_dump(),
+        token=device_auth.create_token(db_credential.id, db_credential.address)
+    )
+
 ###############################################
 #                                             
 #              PATCH Operations               
@@ -107,7 +419,7 @@ async def tags_patch_single(
     tag_id: str,
     tag_in: schemas.TagBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Requires Admin
     if requester.role != 1:
@@ -116,21 +428,32 @@ async def tags_patch_single(
     tag = None
     # Check for tag by UUID
     try:
-        tag = db.query(models.Tag).filter(models.Tag.id == uuid.UUID(tag_id)).first()
+        tag = await db.scalar(select(models.Tag).where(models.Tag.id == uuid.UUID(tag_id)))
     except:
         pass
 
     if tag is None:
         raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
     
+    revoked = []
+
     try:
+        # Tokens are bound to the address, so they cannot follow it
+        if tag.address != tag_in.address:
+            revoked = await tags_revoke_credentials(db, tag.id)
+
         tag.name = tag_in.name
         tag.address = tag_in.address
-        db.commit()
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
-    return tag
+    device_auth.verifier.revoke(*revoked)
+
+    # The store holds the live position of the tag
+    store.put(tag)
+
+    return store.get(tag.id)
 
 
 ###############################################
@@ -144,7 +467,7 @@ async def tags_patch_single(
 async def tags_delete_single(
     tag_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -154,7 +477,7 @@ async def tags_delete_single(
 
     # Check for tag by UUID
     try:
-        tag = db.query(models.Tag).filter(models.Tag.id == uuid.UUID(tag_id)).first()
+        tag = await db.scalar(select(models.Tag).where(models.Tag.id == uuid.UUID(tag_id)))
     except:
         pass
 
@@ -163,9 +486,72 @@ async def tags_delete_single(
         raise HTTPException(status_code=404, detail="A tag with that ID does not exist.")
     
     try:
-        db.delete(tag)
-        db.commit()
+        revoked = await tags_revoke_credentials(db, tag.id)
+        await db.delete(tag)
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    device_auth.verifier.revoke(*revoked)
+
+    return store.remove(tag.id) or tag
+
+# Admin ============= Delete Tag: Revoke a device credential
+@router.delete("/{tag_id}/credentials/{credential_id}", response_model=schemas.DeviceCredentialShow)
+async def tags_delete_credential(
+    tag_id: str,
+    credential_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    credential = None
+
+    try:
+        credential = await db.scalar(
+            select(models.DeviceCredential)
+            .where(models.DeviceCredential.id == uuid.UUID(credential_id), models.DeviceCredential.tag_id == uuid.UUID(tag_id))
+        )
+    except:
+        pass
+
+    if credential is None:
+        raise HTTPException(status_code=404, detail="A credential with that ID does not exist for this tag.")
+
+    # Kept as revoked so every worker learns about it on its next refresh
+    try:
+        credential.revoked = True
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
-    return tag
\ No newline at end of file
+    device_auth.verifier.revoke(credential.id)
+
+    return credential
+
+###############################################
+#                                             
+#             WebSocket Operations            
+#                                             
+###############################################
+
+# User ============== WS Tag: Live presence changes
+@router.websocket("/presence")
+async def tags_presence_stream(
+    websocket: WebSocket,
+    token: str,
+    db: AsyncSession = Depends(database.get)
+):
+    # Browsers cannot set headers on a websocket, so the token is a query parameter
+    user = await auth.user_from_token(token, db)
+    await db.close()
+
+    if user is None or user.disabled:
+        raise WebSocketException(code=1008, reason="Missing, invalid, or expired token.")
+
+    await websocket.accept()
+
+    await presence_stream.serve(websocket, presence_stream.subscribe())
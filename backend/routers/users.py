@@ -1,12 +1,15 @@
-from fastapi import Depends, HTTPException, APIRouter
+from autonav_secrets import PAGE_MAX_LIMIT
+from fastapi import Depends, HTTPException, APIRouter, Query
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
 import schemas
 import database
 from . import auth
 import models
 import uuid
+import paging
 
 
 router = APIRouter()
@@ -51,15 +54,27 @@ async def users_get_me(
 @router.get("/all", response_model=List[schemas.UserShow])
 async def users_get_all(
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    limit: Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT)] = None,
+    cursor: uuid.UUID | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(database.get)
 ):
     if requester.role != 1:
         raise HTTPException(status_code=403)
 
+    # Paged and projected reads go straight to the table
+    if paging.requested(limit, cursor, fields):
+        page = paging.parse(schemas.UserShow, limit, cursor, fields)
+
+        try:
+            return await paging.fetch(db, models.User, page)
+        except:
+            raise HTTPException(status_code=500)
+
     users = []
 
     try:
-        users = db.query(models.User).all()
+        users = (await db.scalars(select(models.User))).all()
     except:
         raise HTTPException(status_code=500)
 
@@ -70,7 +85,7 @@ async def users_get_all(
 async def users_get_single(
     user_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -78,7 +93,7 @@ async def users_get_single(
 
     user = None
 
-    user = db.query(models.User).filter(models.User.id == uuid.UUID(user_id)).first()
+    user = await db.scalar(select(models.User).where(models.User.id == uuid.UUID(user_id)))
 
     if user is None:
         raise HTTPException(status_code=404, detail="User does not exist.")
@@ -96,7 +111,7 @@ async def users_get_single(
 async def users_post_create(
     user_in: schemas.UserCreate, 
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -107,7 +122,7 @@ async def users_post_create(
     db_user = models.User(
         id = uuid.uuid4(),
         username = user_in.username,
-        hashed_password = auth.hash_password(user_in.password),
+        hashed_password = await auth.hash_password_async(user_in.password),
         first_name = user_in.first_name,
         last_name = user_in.last_name,
         email = user_in.email,
@@ -117,13 +132,13 @@ async def users_post_create(
     db.add(db_user)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(status_code=409, detail="Username or email already exists.")
     except:
         raise HTTPException(status_code=500)
 
-    db.refresh(db_user)
+    await db.refresh(db_user)
 
     return db_user
 
@@ -132,20 +147,20 @@ async def users_post_create(
 async def users_post_newpassword_self(
     passwords_in: schemas.UserUpdatePasswordMe,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
 
-    user = db.query(models.User).filter(models.User.id == requester.id).first()
+    user = await db.scalar(select(models.User).where(models.User.id == requester.id))
 
     if user is None:
         raise HTTPException(status_code=500, detail="Unknown error.")
         
-    if not auth.verify_password(passwords_in.current_password, user.hashed_password):
+    if not await auth.verify_password_async(passwords_in.current_password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid credentials.", headers={"WWW_Authenticate": "Bearer"})
     
     try:
-        user.hashed_password = auth.hash_password(passwords_in.new_password)
-        db.commit()
+        user.hashed_password = await auth.hash_password_async(passwords_in.new_password)
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
     
@@ -157,7 +172,7 @@ async def users_post_newpassword_single(
     user_id: str,
     passwords_in: schemas.UserUpdatePassword,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
 
     # Must be administrator to perform this action
@@ -167,15 +182,15 @@ async def users_post_newpassword_single(
     user = None
 
     # Check for user by UUID
-    user = db.query(models.User).filter(models.User.id == uuid.UUID(user_id)).first()
+    user = await db.scalar(select(models.User).where(models.User.id == uuid.UUID(user_id)))
 
     # A user is not found with the given id/username
     if user is None:
         raise HTTPException(status_code=404, detail="User does not exist.")
     
     try:
-        user.hashed_password = auth.hash_password(passwords_in.new_password)
-        db.commit()
+        user.hashed_password = await auth.hash_password_async(passwords_in.new_password)
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
@@ -192,20 +207,28 @@ async def users_post_newpassword_single(
 async def users_patch_self(
     user_in: schemas.UserUpdateMe,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     validate_format_user(user_in)
 
+    # The requester is a cached principal, not a database row
+    user = await db.scalar(select(models.User).where(models.User.id == requester.id))
+
+    if user is None:
+        raise HTTPException(status_code=500, detail="Unknown error.")
+
     try:
-        requester.first_name = user_in.first_name
-        requester.last_name = user_in.last_name
-        requester.email = user_in.email
-        db.commit()
+        user.first_name = user_in.first_name
+        user.last_name = user_in.last_name
+        user.email = user_in.email
+        await db.commit()
     except:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500)
 
-    return requester
+    auth.principals.invalidate(user.username)
+
+    return user
 
 # Admin ============= PATCH User: Single
 @router.patch("/{user_id}", response_model=schemas.UserShow)
@@ -213,7 +236,7 @@ async def users_patch_single(
     user_id: str,
     user_in: schemas.UserBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     validate_format_user(user_in)
 
@@ -224,12 +247,14 @@ async def users_patch_single(
     user = None
 
     # Check for user by UUID
-    user = db.query(models.User).filter(models.User.id == uuid.UUID(user_id)).first()
+    user = await db.scalar(select(models.User).where(models.User.id == uuid.UUID(user_id)))
 
     # A user is not found with the given id/username
     if user is None:
         raise HTTPException(status_code=404, detail="User does not exist.")
 
+    previous_username = user.username
+
     try:
         user.first_name = user_in.first_name
         user.last_name = user_in.last_name
@@ -237,11 +262,14 @@ async def users_patch_single(
         user.email = user_in.email
         user.role = user_in.role
         user.disabled = user_in.disabled
-        db.commit()
+        await db.commit()
     except:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500)
 
+    # Role or disabled state may have changed
+    auth.principals.invalidate(previous_username, user.username)
+
     return user
 
 ###############################################
@@ -255,7 +283,7 @@ async def users_patch_single(
 async def users_delete_single(
     user_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -264,7 +292,7 @@ async def users_delete_single(
     user = None
 
     # Check for user by UUID
-    user = db.query(models.User).filter(models.User.id == uuid.UUID(user_id)).first()
+    user = await db.scalar(select(models.User).where(models.User.id == uuid.UUID(user_id)))
 
     # A user is not found with the given id/username
     if user is None:
@@ -275,10 +303,12 @@ async def users_delete_single(
         raise HTTPException(status_code=400, detail="You cannot delete your own account.")
     
     try:
-        db.delete(user)
-        db.commit()
+        await db.delete(user)
+        await db.commit()
     except:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500)
 
+    auth.principals.invalidate(user.username)
+
     return user
\ No newline at end of file
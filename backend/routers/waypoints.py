@@ -1,12 +1,20 @@
-from fastapi import Depends, HTTPException, APIRouter
+from autonav_secrets import PAGE_MAX_LIMIT, SPATIAL_COORDINATE_LIMIT
+from fastapi import Depends, HTTPException, APIRouter, Query, Request
+from pydantic import TypeAdapter
+from sqlalchemy import delete, or_, select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
 import schemas
 import database
 from . import auth
 import models
 import uuid
+from collection_cache import CollectionCache
+import paging
+import bulk
+import spatial
+import routing
 
 
 router = APIRouter()
@@ -17,6 +25,26 @@ router = APIRouter()
 #                                             
 ###############################################
 
+# Cached /waypoints/all body, invalidated by every write below
+waypoints_cache = CollectionCache("waypoints")
+waypoints_adapter = TypeAdapter(List[schemas.WaypointShow])
+
+async def waypoints_serialize_all(db: AsyncSession) -> bytes:
+    waypoints = (await db.scalars(select(models.Waypoint))).all()
+    return waypoints_adapter.dump_json(waypoints_adapter.validate_python(waypoints, from_attributes=True))
+
+def waypoints_changed(waypoint: models.Waypoint, deleted: bool = False):
+    # Keep the cached list, the spatial index and the navigation graph in
+    # step with the table
+    waypoints_cache.bump()
+
+    if deleted:
+        spatial.waypoints.remove(waypoint.id)
+        routing.graph.remove_waypoint(waypoint.id)
+    else:
+        spatial.put_waypoint(waypoint)
+        routing.graph.put_waypoint(schemas.WaypointShow.model_validate(waypoint, from_attributes=True))
+
 ###############################################
 #                                             
 #               GET Operations                
@@ -26,29 +54,83 @@ router = APIRouter()
 # User ============== GET Waypoint: All
 @router.get("/all", response_model=List[schemas.WaypointShow])
 async def waypoints_get_all(
+    request: Request,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    limit: Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT)] = None,
+    cursor: uuid.UUID | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(database.get)
 ):
-    waypoints = []
+    # Paged and projected reads go straight to the table
+    if paging.requested(limit, cursor, fields):
+        page = paging.parse(schemas.WaypointShow, limit, cursor, fields)
+
+        try:
+            return await paging.fetch(db, models.Waypoint, page)
+        except:
+            raise HTTPException(status_code=500)
 
     try:
-        waypoints = db.query(models.Waypoint).all()
+        return await waypoints_cache.response(request, lambda: waypoints_serialize_all(db))
     except:
         raise HTTPException(status_code=500)
 
-    return waypoints
+# User ============== GET Waypoint: Nearest to a point
+@router.get("/nearest", response_model=List[schemas.WaypointNearest])
+async def waypoints_get_nearest(
+    x: Annotated[float, Query(ge=-SPATIAL_COORDINATE_LIMIT, le=SPATIAL_COORDINATE_LIMIT, allow_inf_nan=False)],
+    y: Annotated[float, Query(ge=-SPATIAL_COORDINATE_LIMIT, le=SPATIAL_COORDINATE_LIMIT, allow_inf_nan=False)],
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    k: Annotated[int, Query(ge=1, le=100)] = 1
+):
+    return [
+        schemas.WaypointNearest(**waypoint.model_dump(), distance=distance)
+        for distance, waypoint in spatial.waypoints.nearest(x, y, k)
+    ]
+
+# User ============== GET Waypoint: Shortest route between two waypoints
+@router.get("/route", response_model=schemas.WaypointRoute)
+async def waypoints_get_route(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    start: Annotated[uuid.UUID, Query(alias="from")],
+    destination: Annotated[uuid.UUID, Query(alias="to")]
+):
+    try:
+        route = routing.graph.route(start, destination)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="A waypoint with that ID does not exist.")
+
+    if route is None:
+        raise HTTPException(status_code=404, detail="No route connects these waypoints.")
+
+    return route
+
+# User ============== GET Waypoint: All navigation graph edges
+@router.get("/edges", response_model=List[schemas.WaypointEdgeShow])
+async def waypoints_get_edges(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
+):
+    return routing.graph.edges()
+
+# User ============== GET Waypoint: Export all (JSON or CSV), streamed
+@router.get("/export")
+async def waypoints_get_export(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    format: str = "json"
+):
+    return bulk.export_response(models.Waypoint, schemas.WaypointShow, format, "waypoints")
 
 # User ============== GET Waypoint: Single by UUID
 @router.get("/{waypoint_id}", response_model=schemas.WaypointShow)
 async def waypoints_get_single(
     waypoint_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     waypoint = None
 
     # Check for waypoint by UUID
-    waypoint = db.query(models.Waypoint).filter(models.Waypoint.id == uuid.UUID(waypoint_id)).first()
+    waypoint = await db.scalar(select(models.Waypoint).where(models.Waypoint.id == uuid.UUID(waypoint_id)))
 
 
     if waypoint is None:
@@ -67,7 +149,7 @@ async def waypoints_get_single(
 async def waypoints_post_create(
     waypoint_in: schemas.WaypointBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -83,16 +165,89 @@ async def waypoints_post_create(
     db.add(db_waypoint)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(status_code=409, detail="A waypoint with this name already exists.")
     except:
         raise HTTPException(status_code=500)
 
-    db.refresh(db_waypoint)
+    await db.refresh(db_waypoint)
+    waypoints_changed(db_waypoint)
 
     return db_waypoint
 
+# Admin ============= POST Waypoint: Bulk import (JSON array or CSV)
+@router.post("/bulk", response_model=List[schemas.BulkRowStatus])
+async def waypoints_post_bulk(
+    request: Request,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    upsert: bool = False,
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    # Fails with 422 before anything is written if any row is invalid
+    items = await bulk.read_rows(request, schemas.WaypointBulkItem)
+
+    try:
+        statuses, written = await bulk.write_rows(db, models.Waypoint, items, ("name",), upsert)
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The import collided with a concurrent change; nothing was written.")
+    except:
+        raise HTTPException(status_code=500)
+
+    for values in written:
+        waypoints_changed(models.Waypoint(**values))
+
+    return statuses
+
+# Admin ============= POST Waypoint: Connect two waypoints in the navigation graph
+@router.post("/edges", response_model=schemas.WaypointEdgeShow, status_code=201)
+async def waypoints_post_edge(
+    edge_in: schemas.WaypointEdgeBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    if edge_in.waypoint_a == edge_in.waypoint_b:
+        raise HTTPException(status_code=400, detail="An edge must connect two different waypoints.")
+
+    # Edges are undirected; store each pair one way round only
+    a, b = sorted((edge_in.waypoint_a, edge_in.waypoint_b))
+
+    try:
+        found = (await db.scalars(select(models.Waypoint.id).where(models.Waypoint.id.in_((a, b))))).all()
+    except:
+        raise HTTPException(status_code=500)
+
+    if len(found) != 2:
+        raise HTTPException(status_code=404, detail="A waypoint with that ID does not exist.")
+
+    db_edge = models.WaypointEdge(
+        id = uuid.uuid4(),
+        waypoint_a = a,
+        waypoint_b = b
+    )
+
+    db.add(db_edge)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="These waypoints are already connected.")
+    except:
+        raise HTTPException(status_code=500)
+
+    routing.graph.put_edge(db_edge.id, a, b)
+
+    return schemas.WaypointEdgeShow(id=db_edge.id, waypoint_a=a, waypoint_b=b, distance=routing.graph.distance(a, b))
+
 ###############################################
 #                                             
 #              PATCH Operations               
@@ -105,7 +260,7 @@ async def waypoints_patch_single(
     waypoint_id: str,
     waypoint_in: schemas.WaypointBase,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Requires Admin
     if requester.role != 1:
@@ -115,7 +270,7 @@ async def waypoints_patch_single(
 
     # Check for waypoint by UUID
     try:
-        waypoint = db.query(models.Waypoint).filter(models.Waypoint.id == uuid.UUID(waypoint_id)).first()
+        waypoint = await db.scalar(select(models.Waypoint).where(models.Waypoint.id == uuid.UUID(waypoint_id)))
     except:
         pass
 
@@ -126,10 +281,12 @@ async def waypoints_patch_single(
         waypoint.name = waypoint_in.name
         waypoint.pos_x = waypoint_in.pos_x
         waypoint.pos_y = waypoint_in.pos_y
-        db.commit()
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
+    waypoints_changed(waypoint)
+
     return waypoint
 
 # Admin ============= PATCH Waypoint: Single Position Only
@@ -138,7 +295,7 @@ async def waypoints_patch_single_position(
     waypoint_id: str,
     waypoint_in: schemas.WaypointPosition,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Requires Admin
     if requester.role != 1:
@@ -148,7 +305,7 @@ async def waypoints_patch_single_position(
 
     # Check for anchor by UUID
     try:
-        waypoint = db.query(models.Waypoint).filter(models.Waypoint.id == uuid.UUID(waypoint_id)).first()
+        waypoint = await db.scalar(select(models.Waypoint).where(models.Waypoint.id == uuid.UUID(waypoint_id)))
     except:
         pass
 
@@ -158,10 +315,12 @@ async def waypoints_patch_single_position(
     try:
         waypoint.pos_x = waypoint_in.pos_x
         waypoint.pos_y = waypoint_in.pos_y
-        db.commit()
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
+    waypoints_changed(waypoint)
+
     return waypoint
 
 ###############################################
@@ -175,7 +334,7 @@ async def waypoints_patch_single_position(
 async def waypoints_delete_single(
     waypoint_id: str,
     requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     # Must be administrator to perform this action
     if requester.role != 1:
@@ -185,7 +344,7 @@ async def waypoints_delete_single(
 
     # Check for waypoint by UUID
     try:
-        waypoint = db.query(models.Waypoint).filter(models.Waypoint.id == uuid.UUID(waypoint_id)).first()
+        waypoint = await db.scalar(select(models.Waypoint).where(models.Waypoint.id == uuid.UUID(waypoint_id)))
     except:
         pass
 
@@ -194,9 +353,44 @@ async def waypoints_delete_single(
         raise HTTPException(status_code=404, detail="A waypoint with that ID does not exist.")
     
     try:
-        db.delete(waypoint)
-        db.commit()
+        await db.execute(delete(models.WaypointEdge).where(or_(models.WaypointEdge.waypoint_a == waypoint.id, models.WaypointEdge.waypoint_b == waypoint.id)))
+        await db.delete(waypoint)
+        await db.commit()
     except:
         raise HTTPException(status_code=500)
 
-    return waypoint
\ No newline at end of file
+    waypoints_changed(waypoint, deleted=True)
+
+    return waypoint
+
+# Admin ============= Delete Waypoint: Navigation graph edge
+@router.delete("/edges/{edge_id}", response_model=schemas.WaypointEdgeBase)
+async def waypoints_delete_edge(
+    edge_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    edge = None
+
+    # Check for edge by UUID
+    try:
+        edge = await db.scalar(select(models.WaypointEdge).where(models.WaypointEdge.id == uuid.UUID(edge_id)))
+    except:
+        pass
+
+    if edge is None:
+        raise HTTPException(status_code=404, detail="An edge with that ID does not exist.")
+
+    try:
+        await db.delete(edge)
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    routing.graph.remove_edge(edge.id)
+
+    return edge
\ No newline at end of file
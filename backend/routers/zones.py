@@ -0,0 +1,299 @@
+from autonav_secrets import STREAM_MAX_RATE_HZ, STREAM_MAX_PENDING
+from datetime import datetime
+from fastapi import Depends, HTTPException, APIRouter, Query, WebSocket, WebSocketException
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, List
+from broadcast import Broadcaster
+import schemas
+import database
+from . import auth
+import models
+import uuid
+import itertools
+import json
+import geofence
+from tag_store import store, naive_local
+
+
+router = APIRouter()
+
+###############################################
+#                                             
+#              Helper Functions               
+#                                             
+###############################################
+
+# Zone enter/exit events for /zones/stream subscribers. Every event gets its
+# own key so events are never coalesced away.
+zone_stream = Broadcaster(max_rate=STREAM_MAX_RATE_HZ, max_pending=STREAM_MAX_PENDING)
+zone_event_keys = itertools.count()
+
+def zone_event_message(event: dict) -> str:
+    return json.dumps({
+        "tag_id": str(event["tag_id"]),
+        "zone_id": str(event["zone_id"]),
+        "kind": event["kind"],
+        "timestamp": event["timestamp"].isoformat()
+    })
+
+def publish_zone_event(event: dict):
+    if zone_stream.subscriber_count == 0:
+        return
+
+    zone_stream.publish(next(zone_event_keys), zone_event_message(event))
+
+geofence.engine.add_listener(publish_zone_event)
+
+###############################################
+#                                             
+#               GET Operations                
+#                                             
+###############################################
+
+# User ============== GET Zone: All
+@router.get("/all", response_model=List[schemas.ZoneShow])
+async def zones_get_all(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    zones = []
+
+    try:
+        zones = (await db.scalars(select(models.Zone))).all()
+    except:
+        raise HTTPException(status_code=500)
+
+    return zones
+
+# User ============== GET Zone: Enter/exit events, newest first
+@router.get("/events", response_model=List[schemas.ZoneEventShow])
+async def zones_get_events(
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    tag_id: uuid.UUID | None = None,
+    zone_id: uuid.UUID | None = None,
+    start: Annotated[datetime | None, Query(alias="from")] = None,
+    end: Annotated[datetime | None, Query(alias="to")] = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    db: AsyncSession = Depends(database.get)
+):
+    statement = select(models.ZoneEvent)
+    start = naive_local(start) if start is not None else None
+    end = naive_local(end) if end is not None else None
+
+    if tag_id is not None:
+        statement = statement.where(models.ZoneEvent.tag_id == tag_id)
+    if zone_id is not None:
+        statement = statement.where(models.ZoneEvent.zone_id == zone_id)
+    if start is not None:
+        statement = statement.where(models.ZoneEvent.timestamp >= start)
+    if end is not None:
+        statement = statement.where(models.ZoneEvent.timestamp < end)
+
+    statement = statement.order_by(models.ZoneEvent.timestamp.desc(), models.ZoneEvent.id.desc()).limit(limit)
+
+    # Events still waiting for the background flush are merged in from
+    # memory. They are read first: an event flushed in between is then in
+    # both and skipped here, never in neither.
+    pending = [
+        event for event in geofence.engine.pending()
+        if (tag_id is None or event["tag_id"] == tag_id)
+        and (zone_id is None or event["zone_id"] == zone_id)
+        and (start is None or event["timestamp"] >= start)
+        and (end is None or event["timestamp"] < end)
+    ]
+
+    try:
+        events = (await db.scalars(statement)).all()
+    except:
+        raise HTTPException(status_code=500)
+
+    stored = {(e.tag_id, e.zone_id, e.kind, e.timestamp) for e in events}
+    merged = [
+        schemas.ZoneEventShow(**event) for event in reversed(pending)
+        if (event["tag_id"], event["zone_id"], event["kind"], event["timestamp"]) not in stored
+    ]
+    merged += events
+
+    # Stable, so newer pending events stay ahead of stored ones at the same time
+    merged.sort(key=lambda e: e.timestamp, reverse=True)
+    return merged[:limit]
+
+# User ============== GET Zone: Single by UUID
+@router.get("/{zone_id}", response_model=schemas.ZoneShow)
+async def zones_get_single(
+    zone_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    zone = None
+
+    # Check for zone by UUID
+    try:
+        zone = await db.scalar(select(models.Zone).where(models.Zone.id == uuid.UUID(zone_id)))
+    except:
+        pass
+
+    if zone is None:
+        raise HTTPException(status_code=404, detail="A zone with that ID does not exist.")
+
+    return zone
+
+# User ============== GET Zone: Tags currently inside
+@router.get("/{zone_id}/tags", response_model=List[schemas.TagShow])
+async def zones_get_tags(
+    zone_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)]
+):
+    try:
+        zone_id = uuid.UUID(zone_id)
+    except:
+        raise HTTPException(status_code=404, detail="A zone with that ID does not exist.")
+
+    tags = [store.get(tag_id) for tag_id in geofence.engine.occupants(zone_id)]
+
+    return [tag for tag in tags if tag is not None]
+
+###############################################
+#                                             
+#               POST Operations               
+#                                             
+###############################################
+
+# Admin ============= POST Zone: Create
+@router.post("", response_model=schemas.ZoneShow, status_code=201)
+async def zones_post_create(
+    zone_in: schemas.ZoneBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    db_zone = models.Zone(
+        id = uuid.uuid4(),
+        name = zone_in.name,
+        points = [list(point) for point in zone_in.points]
+    )
+
+    db.add(db_zone)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A zone with this name already exists.")
+    except:
+        raise HTTPException(status_code=500)
+
+    await db.refresh(db_zone)
+    geofence.engine.put_zone(db_zone)
+
+    return db_zone
+
+###############################################
+#                                             
+#              PATCH Operations               
+#                                             
+###############################################
+
+# Admin ============= PATCH Zone: Single
+@router.patch("/{zone_id}", response_model=schemas.ZoneShow)
+async def zones_patch_single(
+    zone_id: str,
+    zone_in: schemas.ZoneBase,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Requires Admin
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    zone = None
+
+    # Check for zone by UUID
+    try:
+        zone = await db.scalar(select(models.Zone).where(models.Zone.id == uuid.UUID(zone_id)))
+    except:
+        pass
+
+    if zone is None:
+        raise HTTPException(status_code=404, detail="A zone with that ID does not exist.")
+
+    try:
+        zone.name = zone_in.name
+        zone.points = [list(point) for point in zone_in.points]
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A zone with this name already exists.")
+    except:
+        raise HTTPException(status_code=500)
+
+    geofence.engine.put_zone(zone)
+
+    return zone
+
+###############################################
+#                                             
+#              DELETE Operations              
+#                                             
+###############################################
+
+# Admin ============= Delete Zone: Single
+@router.delete("/{zone_id}", response_model=schemas.ZoneShow)
+async def zones_delete_single(
+    zone_id: str,
+    requester: Annotated[schemas.UserShow, Depends(auth.authenticate_token)],
+    db: AsyncSession = Depends(database.get)
+):
+    # Must be administrator to perform this action
+    if requester.role != 1:
+        raise HTTPException(status_code=403)
+
+    zone = None
+
+    # Check for zone by UUID
+    try:
+        zone = await db.scalar(select(models.Zone).where(models.Zone.id == uuid.UUID(zone_id)))
+    except:
+        pass
+
+    # A zone is not found with the given uuid
+    if zone is None:
+        raise HTTPException(status_code=404, detail="A zone with that ID does not exist.")
+
+    try:
+        await db.delete(zone)
+        await db.commit()
+    except:
+        raise HTTPException(status_code=500)
+
+    # Tags inside the zone receive an exit event
+    geofence.engine.remove_zone(zone.id)
+
+    return zone
+
+###############################################
+#                                             
+#             WebSocket Operations            
+#                                             
+###############################################
+
+# User ============== WS Zone: Live enter/exit events
+@router.websocket("/stream")
+async def zones_stream(
+    websocket: WebSocket,
+    token: str,
+    db: AsyncSession = Depends(database.get)
+):
+    # Browsers cannot set headers on a websocket, so the token is a query parameter
+    user = await auth.user_from_token(token, db)
+    await db.close()
+
+    if user is None or user.disabled:
+        raise WebSocketException(code=1008, reason="Missing, invalid, or expired token.")
+
+    await websocket.accept()
+
+    await zone_stream.serve(websocket, zone_stream.subscribe())
@@ -0,0 +1,230 @@
+from autonav_secrets import ROUTE_CACHE_SOURCES
+from collections import OrderedDict
+from sqlalchemy import select
+import heapq
+import math
+import database
+import models
+import schemas
+import stats
+
+# Route planning over the waypoint navigation graph.
+#
+# Waypoints are the nodes and the rows of waypoint_edges the (undirected)
+# edges; an edge is as long as the straight line between its waypoints. The
+# graph is loaded on startup and kept current by the waypoint handlers.
+#
+# A route query runs Dijkstra once from its start waypoint and caches the
+# whole shortest path tree (distance and predecessor of every reachable
+# waypoint), so every later route from that start, or to it, is a walk up
+# the tree. The ROUTE_CACHE_SOURCES most recently used trees are kept.
+#
+# Changes only drop the trees they can affect: a tree survives a new or
+# shorter edge unless the edge shortens a path in it, and survives a removed
+# or longer edge unless the edge is part of it. Moving a waypoint changes
+# the lengths of its edges and is checked edge by edge.
+
+route_hits = stats.counter("route_cache_hits", "Routes answered from a cached shortest path tree.")
+route_misses = stats.counter("route_cache_misses", "Shortest path trees computed for routes.")
+route_invalidations = stats.counter("route_cache_invalidations", "Cached shortest path trees dropped by graph changes.")
+
+class ShortestPaths:
+
+    def __init__(self, source):
+        self.source = source
+        self.distance = {source: 0.0}
+        self.previous = {}
+
+    def uses(self, a, b) -> bool:
+        return self.previous.get(b) == a or self.previous.get(a) == b
+
+    def path(self, target) -> list | None:
+        if target not in self.distance:
+            return None
+
+        path = [target]
+        while path[-1] != self.source:
+            path.append(self.previous[path[-1]])
+
+        return path
+
+class NavigationGraph:
+
+    def __init__(self, cache_size: int = ROUTE_CACHE_SOURCES):
+        self.cache_size = cache_size
+
+        self._waypoints = {} # id -> WaypointShow
+        self._edges = {} # id -> {neighbour id: (edge id, length)}
+        self._ends = {} # edge id -> (waypoint a, waypoint b)
+        self._trees = OrderedDict() # source id -> ShortestPaths
+
+    def __contains__(self, waypoint_id) -> bool:
+        return waypoint_id in self._waypoints
+
+    def _length(self, a, b) -> float:
+        wa = self._waypoints[a]
+        wb = self._waypoints[b]
+        return math.hypot(wa.pos_x - wb.pos_x, wa.pos_y - wb.pos_y)
+
+    #@@@@@ Maintenance
+    def put_waypoint(self, waypoint: schemas.WaypointShow):
+        previous = self._waypoints.get(waypoint.id)
+        self._waypoints[waypoint.id] = waypoint
+        neighbours = self._edges.setdefault(waypoint.id, {})
+
+        if previous is None or (previous.pos_x == waypoint.pos_x and previous.pos_y == waypoint.pos_y):
+            return
+
+        # Moved: every edge of the waypoint changes length
+        for neighbour, (edge_id, old) in list(neighbours.items()):
+            new = self._length(waypoint.id, neighbour)
+            neighbours[neighbour] = (edge_id, new)
+            self._edges[neighbour][waypoint.id] = (edge_id, new)
+            self._edge_changed(waypoint.id, neighbour, old, new)
+
+    def remove_waypoint(self, waypoint_id):
+        if waypoint_id not in self._waypoints:
+            return
+
+        for neighbour, (edge_id, _) in list(self._edges[waypoint_id].items()):
+            self.remove_edge(edge_id)
+
+        del self._waypoints[waypoint_id]
+        del self._edges[waypoint_id]
+
+        if self._trees.pop(waypoint_id, None) is not None:
+            route_invalidations.inc()
+
+    def put_edge(self, edge_id, a, b):
+        # Both waypoints must already be in the graph
+        if edge_id in self._ends:
+            self.remove_edge(edge_id)
+
+        length = self._length(a, b)
+        old = self._edges[a].get(b)
+
+        self._edges[a][b] = (edge_id, length)
+        self._edges[b][a] = (edge_id, length)
+        self._ends[edge_id] = (a, b)
+        self._edge_changed(a, b, None if old is None else old[1], length)
+
+    def remove_edge(self, edge_id):
+        ends = self._ends.pop(edge_id, None)
+
+        if ends is None:
+            return
+
+        a, b = ends
+        _, length = self._edges[a].pop(b)
+        del self._edges[b][a]
+        self._edge_changed(a, b, length, None)
+
+    def _edge_changed(self, a, b, old: float | None, new: float | None):
+        # old/new: length before/after, None when the edge is absent
+        stale = []
+
+        for source, tree in self._trees.items():
+            if old is not None and (new is None or new > old) and tree.uses(a, b):
+                stale.append(source)
+            elif new is not None:
+                da = tree.distance.get(a, math.inf)
+                db = tree.distance.get(b, math.inf)
+                if da + new < db or db + new < da:
+                    stale.append(source)
+
+        for source in stale:
+            del self._trees[source]
+
+        route_invalidations.inc(len(stale))
+
+    def clear(self):
+        self._waypoints.clear()
+        self._edges.clear()
+        self._ends.clear()
+        self._trees.clear()
+
+    #@@@@@ Queries
+    def distance(self, a, b) -> float:
+        return self._edges[a][b][1]
+
+    def edges(self) -> list:
+        return [
+            schemas.WaypointEdgeShow(id=edge_id, waypoint_a=a, waypoint_b=b, distance=self.distance(a, b))
+            for edge_id, (a, b) in self._ends.items()
+        ]
+
+    def _tree(self, source) -> ShortestPaths:
+        tree = self._trees.get(source)
+
+        if tree is not None:
+            self._trees.move_to_end(source)
+            route_hits.inc()
+            return tree
+
+        route_misses.inc()
+        tree = ShortestPaths(source)
+        distance = tree.distance
+        done = set()
+        queue = [(0.0, 0, source)]
+        counter = 1
+
+        while len(queue) > 0:
+            d, _, node = heapq.heappop(queue)
+
+            if node in done:
+                continue
+            done.add(node)
+
+            for neighbour, (_, length) in self._edges[node].items():
+                candidate = d + length
+                if candidate < distance.get(neighbour, math.inf):
+                    distance[neighbour] = candidate
+                    tree.previous[neighbour] = node
+                    heapq.heappush(queue, (candidate, counter, neighbour))
+                    counter += 1
+
+        self._trees[source] = tree
+
+        while len(self._trees) > self.cache_size:
+            self._trees.popitem(last=False)
+
+        return tree
+
+    def route(self, start, destination) -> schemas.WaypointRoute | None:
+        # Raises KeyError for an unknown waypoint; None if unreachable.
+        # The graph is undirected, so a cached tree of the destination
+        # answers the route reversed.
+        if start not in self._waypoints or destination not in self._waypoints:
+            raise KeyError(start if start not in self._waypoints else destination)
+
+        if destination in self._trees and start not in self._trees:
+            tree = self._tree(destination)
+            path = tree.path(start)
+        else:
+            tree = self._tree(start)
+            path = tree.path(destination)
+            if path is not None:
+                path.reverse()
+
+        if path is None:
+            return None
+
+        return schemas.WaypointRoute(
+            distance=tree.distance[path[-1] if tree.source == start else path[0]],
+            waypoints=[self._waypoints[waypoint_id] for waypoint_id in path]
+        )
+
+
+graph = NavigationGraph()
+
+async def start():
+    async with database.SessionLocal() as db:
+        waypoints = (await db.scalars(select(models.Waypoint))).all()
+        edges = (await db.execute(select(models.WaypointEdge.id, models.WaypointEdge.waypoint_a, models.WaypointEdge.waypoint_b))).all()
+
+    graph.clear()
+    for waypoint in waypoints:
+        graph.put_waypoint(schemas.WaypointShow.model_validate(waypoint, from_attributes=True))
+    for edge_id, a, b in edges:
+        if a in graph and b in graph:
+            graph.put_edge(edge_id, a, b)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Annotated, Optional, List, Tuple
 from uuid import UUID
 
 class Token(BaseModel):
@@ -53,6 +53,36 @@ class TagShow(TagBase):
     pos_y: Optional[float] = None
     last_contact: Optional[datetime] = None
 
+class TagNear(TagShow):
+    distance: float
+
+class TagPresence(TagShow):
+    state: str # "online" or "stale"
+
+class DeviceCredentialBase(BaseModel):
+    name: Optional[str] = None
+
+class DeviceCredentialShow(DeviceCredentialBase):
+    id: UUID
+    tag_id: UUID
+    address: str
+    created_at: datetime
+    revoked: bool
+
+class DeviceCredentialToken(DeviceCredentialShow):
+    token: str # Only returned when the credential is created
+
+class TagChanges(BaseModel):
+    cursor: str # Pass as 'since' on the next poll
+    resync: bool # True when tags is the full list and replaces the client's copy
+    tags: List[TagShow] # Current state of the changed tags
+    deleted: List[UUID] = []
+
+class TagHistoryPoint(BaseModel):
+    timestamp: datetime
+    pos_x: float
+    pos_y: float
+    samples: int
 
 ###### ANCHORS
 
@@ -66,6 +96,9 @@ class AnchorBase(BaseModel):
 class AnchorShow(AnchorBase):
     id: UUID
 
+class AnchorBulkItem(AnchorBase):
+    id: Optional[UUID] = None
+
 class AnchorPosition(BaseModel):
     pos_x: float
     pos_y: float
@@ -81,13 +114,97 @@ class WaypointBase(BaseModel):
 class WaypointShow(WaypointBase):
     id: UUID
 
+class WaypointBulkItem(WaypointBase):
+    id: Optional[UUID] = None
+
+class WaypointNearest(WaypointShow):
+    distance: float
+
 class WaypointPosition(BaseModel):
     pos_x: float
     pos_y: float
 
+class WaypointEdgeBase(BaseModel):
+    waypoint_a: UUID
+    waypoint_b: UUID
+
+class WaypointEdgeShow(WaypointEdgeBase):
+    id: UUID
+    distance: Optional[float] = None
+
+class WaypointRoute(BaseModel):
+    distance: float
+    waypoints: List[WaypointShow] # From start to destination, both included
+
+
+###### MAPS
+
+class MapBase(BaseModel):
+    site: str
+    floor: str
+    name: Optional[str] = None
+    pixels_per_metre: float = Field(gt=0)
+    origin_x: float = 0.0 # Pixel column of the map origin
+    origin_y: float = 0.0 # Pixel row of the map origin
+
+class MapShow(MapBase):
+    id: UUID
+    width: Optional[int] = None
+    height: Optional[int] = None
+    tile_size: Optional[int] = None
+    levels: Optional[int] = None
+    tiles_version: Optional[str] = None
+
+
+###### BULK IMPORT
+
+class BulkRowStatus(BaseModel):
+    row: int # Index of the row in the import
+    id: Optional[UUID] = None
+    status: str # "created", "updated" or "conflict"
+    detail: Optional[str] = None
+
+
+###### ZONES
+
+class ZoneBase(BaseModel):
+    name: str
+    points: List[Tuple[Annotated[float, Field(allow_inf_nan=False)], Annotated[float, Field(allow_inf_nan=False)]]] = Field(min_length=3) # Polygon vertices, in order
+
+class ZoneShow(ZoneBase):
+    id: UUID
+
+class ZoneEventShow(BaseModel):
+    tag_id: UUID
+    zone_id: UUID
+    kind: str # "enter" or "exit"
+    timestamp: datetime
+
 
 #### POSITION
 class TagPosition(BaseModel):
     address: str
-    pos_x: float
-    pos_y: float
\ No newline at end of file
+    pos_x: float = Field(allow_inf_nan=False)
+    pos_y: float = Field(allow_inf_nan=False)
+
+class TagPositionBatchItem(TagPosition):
+    timestamp: Optional[datetime] = None
+
+class TagPositionStatus(BaseModel):
+    address: str
+    status: str # "updated", "superseded", "not_found" or "forbidden"
+
+class TagRange(BaseModel):
+    anchor: str # Anchor address
+    distance: float = Field(allow_inf_nan=False) # Raw range reported by the tag
+    timestamp: Optional[datetime] = None
+
+class TagRanges(BaseModel):
+    address: str
+    ranges: List[TagRange]
+
+class TagRangesStatus(BaseModel):
+    address: str
+    status: str # "updated", "superseded", "unsolvable", "not_found" or "forbidden"
+    pos_x: Optional[float] = None
+    pos_y: Optional[float] = None
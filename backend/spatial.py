@@ -0,0 +1,204 @@
+from autonav_secrets import SPATIAL_CELL_SIZE
+from sqlalchemy import select
+import heapq
+import math
+import database
+import models
+import schemas
+from tag_store import store, TagEntry
+
+# In-memory spatial indexes for waypoints and live tags.
+#
+# A GridIndex hashes points into square cells of SPATIAL_CELL_SIZE map
+# units, so a query only visits the cells that overlap the area of
+# interest. Inserts, moves and removals are O(1). The waypoint index is
+# loaded on startup and kept current by the waypoint CRUD handlers; the tag
+# index follows the tag store through its listener.
+
+class GridIndex:
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self._cells = {} # (cx, cy) -> {key: (x, y, payload)}
+        self._points = {} # key -> (cx, cy)
+        self._bounds = None # min/max occupied cell coordinates, grow-only
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    #@@@@@ Maintenance
+    def put(self, key, x: float, y: float, payload):
+        cell = self._cell(x, y)
+        previous = self._points.get(key)
+
+        if previous is not None and previous != cell:
+            self._discard(key, previous)
+
+        self._cells.setdefault(cell, {})[key] = (x, y, payload)
+        self._points[key] = cell
+
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            b = self._bounds
+            b[0] = min(b[0], cell[0])
+            b[1] = min(b[1], cell[1])
+            b[2] = max(b[2], cell[0])
+            b[3] = max(b[3], cell[1])
+
+    def remove(self, key):
+        cell = self._points.pop(key, None)
+
+        if cell is not None:
+            self._discard(key, cell)
+
+    def _discard(self, key, cell: tuple):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if len(bucket) == 0:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+        self._bounds = None
+
+    #@@@@@ Queries
+    def within(self, min_x: float, min_y: float, max_x: float, max_y: float) -> list:
+        # Payloads of every point inside the box, edges included
+        return [
+            payload
+            for x, y, payload in self._within_items(min_x, min_y, max_x, max_y)
+            if min_x <= x <= max_x and min_y <= y <= max_y
+        ]
+
+    def near(self, x: float, y: float, radius: float) -> list:
+        # (distance, payload) of every point within radius, closest first
+        results = []
+        r2 = radius * radius
+
+        for payload_x, payload_y, payload in self._within_items(x - radius, y - radius, x + radius, y + radius):
+            d2 = (payload_x - x) ** 2 + (payload_y - y) ** 2
+            if d2 <= r2:
+                results.append((math.sqrt(d2), payload))
+
+        results.sort(key=lambda item: item[0])
+        return results
+
+    def _within_items(self, min_x, min_y, max_x, max_y):
+        # Candidate points of the cells overlapping the box. Walks whichever
+        # is smaller: the cells covering the box or the occupied cells.
+        low = self._cell(min_x, min_y)
+        high = self._cell(max_x, max_y)
+
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > len(self._cells):
+            for cell, bucket in self._cells.items():
+                if low[0] <= cell[0] <= high[0] and low[1] <= cell[1] <= high[1]:
+                    yield from bucket.values()
+        else:
+            for cx in range(low[0], high[0] + 1):
+                for cy in range(low[1], high[1] + 1):
+                    bucket = self._cells.get((cx, cy))
+                    if bucket is not None:
+                        yield from bucket.values()
+
+    def _ring(self, cx: int, cy: int, ring: int) -> list:
+        # Cells at Chebyshev distance ring from (cx, cy), clipped to the
+        # occupied bounds
+        b = self._bounds
+        if ring == 0:
+            return [(cx, cy)]
+
+        cells = []
+        low_x, high_x = max(cx - ring, b[0]), min(cx + ring, b[2])
+        low_y, high_y = max(cy - ring + 1, b[1]), min(cy + ring - 1, b[3])
+
+        for y in (cy - ring, cy + ring):
+            if b[1] <= y <= b[3]:
+                cells += [(x, y) for x in range(low_x, high_x + 1)]
+        for x in (cx - ring, cx + ring):
+            if b[0] <= x <= b[2]:
+                cells += [(x, y) for y in range(low_y, high_y + 1)]
+
+        return cells
+
+    def nearest(self, x: float, y: float, k: int) -> list:
+        # (distance, payload) of the k closest points, closest first.
+        # Rings of cells around the query cell are searched outwards until
+        # no unvisited cell can hold a closer point than the k-th best.
+        # Rings start at the first one that reaches the occupied bounds and
+        # only visit cells inside them; once the rings have cost more cells
+        # than are occupied, the occupied cells are scanned instead.
+        if k <= 0 or self._bounds is None:
+            return []
+
+        cx, cy = self._cell(x, y)
+        b = self._bounds
+        first_ring = max(b[0] - cx, cx - b[2], b[1] - cy, cy - b[3], 0)
+        last_ring = max(cx - b[0], b[2] - cx, cy - b[1], b[3] - cy, 0)
+
+        best = [] # max-heap of (-distance, counter, payload)
+        counter = 0
+        visited = 0
+
+        for ring in range(first_ring, last_ring + 1):
+            cells = self._ring(cx, cy, ring)
+            visited += len(cells)
+            scan_all = visited > len(self._cells)
+
+            if scan_all:
+                best = []
+
+            for bucket in (self._cells.values() if scan_all else filter(None, map(self._cells.get, cells))):
+                for payload_x, payload_y, payload in bucket.values():
+                    distance = math.hypot(payload_x - x, payload_y - y)
+                    counter += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, counter, payload))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, counter, payload))
+
+            # Points outside this ring are at least ring * cell_size away
+            if scan_all or (len(best) == k and -best[0][0] <= ring * self.cell_size):
+                break
+
+        return [(-d, payload) for d, _, payload in sorted(best, reverse=True)]
+
+
+waypoints = GridIndex(SPATIAL_CELL_SIZE)
+tags = GridIndex(SPATIAL_CELL_SIZE)
+
+#@@@@@ Waypoints
+def put_waypoint(waypoint: models.Waypoint):
+    waypoints.put(waypoint.id, waypoint.pos_x, waypoint.pos_y, schemas.WaypointShow.model_validate(waypoint, from_attributes=True))
+
+async def load_waypoints():
+    async with database.SessionLocal() as db:
+        rows = (await db.scalars(select(models.Waypoint))).all()
+
+    waypoints.clear()
+    for waypoint in rows:
+        put_waypoint(waypoint)
+
+#@@@@@ Tags
+def tag_listener(kind: str, entry: TagEntry):
+    if kind == "contact":
+        return
+
+    if kind == "remove" or entry.pos_x is None or entry.pos_y is None:
+        tags.remove(entry.id)
+    else:
+        tags.put(entry.id, entry.pos_x, entry.pos_y, entry)
+
+store.add_listener(tag_listener)
+
+async def start():
+    await load_waypoints()
+
+    tags.clear()
+    for entry in store.all():
+        tag_listener("put", entry)
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+
+# Process-wide metrics for the API, the internal caches and pipelines,
+# reported as JSON by GET /stats and in Prometheus text format by
+# GET /metrics. Metrics are plain numbers updated from the event loop; an
+# occasional lost increment is acceptable. Gauges are sampled from a
+# callback when the metrics are read.
+
+PREFIX = "autonav_"
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self):
+        yield "_total", (), self.value
+
+class Gauge:
+    __slots__ = ("name", "help", "sample")
+
+    def __init__(self, name: str, help: str, sample):
+        self.name = name
+        self.help = help
+        self.sample = sample
+
+    @property
+    def value(self):
+        return self.sample()
+
+    def samples(self):
+        yield "", (), self.value
+
+class CounterFamily:
+    # Counter with one series per combination of label values
+    __slots__ = ("name", "help", "labels", "series")
+
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    @property
+    def value(self):
+        return {",".join(k): v for k, v in self.series.items()}
+
+    def samples(self):
+        for label_values, value in list(self.series.items()):
+            yield "_total", tuple(zip(self.labels, label_values)), value
+
+class Histogram:
+    __slots__ = ("name", "help", "labels", "buckets", "series")
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {} # label values -> [bucket counts, sum, count]
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @property
+    def value(self):
+        return {",".join(k): {"count": s[2], "sum": s[1]} for k, s in self.series.items()}
+
+    def samples(self):
+        for label_values, (counts, total, count) in list(self.series.items()):
+            labels = tuple(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+registry = {}
+
+def counter(name: str, help: str) -> Counter:
+    if name not in registry:
+        registry[name] = Counter(name, help)
+    return registry[name]
+
+def counter_family(name: str, help: str, labels: tuple) -> CounterFamily:
+    if name not in registry:
+        registry[name] = CounterFamily(name, help, labels)
+    return registry[name]
+
+def gauge(name: str, help: str, sample) -> Gauge:
+    registry[name] = Gauge(name, help, sample)
+    return registry[name]
+
+def histogram(name: str, help: str, labels: tuple, buckets: tuple) -> Histogram:
+    if name not in registry:
+        registry[name] = Histogram(name, help, labels, buckets)
+    return registry[name]
+
+def snapshot() -> dict:
+    return {name: metric.value for name, metric in sorted(registry.items())}
+
+#@@@@@ Prometheus text exposition format
+TYPES = {Counter: "counter", CounterFamily: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def render_prometheus() -> str:
+    lines = []
+
+    for name, metric in sorted(registry.items()):
+        full_name = PREFIX + name
+        kind = TYPES[type(metric)]
+        type_name = full_name + "_total" if kind == "counter" else full_name
+
+        lines.append(f"# HELP {type_name} {metric.help}")
+        lines.append(f"# TYPE {type_name} {kind}")
+
+        for suffix, labels, value in metric.samples():
+            if len(labels) > 0:
+                label_text = "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+            else:
+                label_text = ""
+            lines.append(f"{full_name}{suffix}{label_text} {float(value)!r}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,266 @@
+from autonav_secrets import TAG_FLUSH_INTERVAL_SECONDS, INGEST_MOVE_EPSILON, INGEST_HEARTBEAT_SECONDS
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, select, update
+import asyncio
+import math
+import threading
+import database
+import models
+import stats
+
+# In-memory store of live tag state. Position writes land here first and a
+# background task persists the latest value per tag to the database every
+# TAG_FLUSH_INTERVAL_SECONDS. The database stays the source of truth for
+# restarts: the store is loaded from the tags table on startup.
+#
+# A parked tag keeps reporting the same position, so fixes that moved less
+# than INGEST_MOVE_EPSILON from the last stored position, and arrive within
+# INGEST_HEARTBEAT_SECONDS of it, are suppressed: they only refresh
+# last_contact in memory and are not written until the next stored fix (or
+# shutdown). A tag that stays put is still written once per heartbeat.
+#
+# Other subsystems follow changes with add_listener(fn); fn(kind, entry) is
+# called after every change with kind one of "position", "contact" (a
+# suppressed fix refreshed last_contact only), "put" or "remove".
+#
+# Positions must be finite. A tag whose row the database rejects on flush
+# (database.ROW_ERRORS) is not retried until its next change; other flush
+# errors leave every flushed tag dirty for the next flush, which only ever
+# writes the latest state of each tag.
+
+# Bulk UPDATE applied once per flush, executed as a single executemany
+tags_bulk_update = (
+    update(models.Tag.__table__)
+    .where(models.Tag.__table__.c.id == bindparam("b_id"))
+    .values(
+        pos_x=bindparam("b_pos_x"),
+        pos_y=bindparam("b_pos_y"),
+        last_contact=bindparam("b_last_contact")
+    )
+)
+
+fixes_accepted = stats.counter("ingest_fixes_accepted", "Position fixes stored.")
+fixes_suppressed = stats.counter("ingest_fixes_suppressed", "Position fixes that only refreshed last_contact.")
+flush_rejected = stats.counter("tag_flush_rejected", "Tag rows rejected by the database on flush and not retried.")
+
+def naive_local(timestamp: datetime) -> datetime:
+    # last_contact is stored as a naive local time
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+class TagEntry:
+    __slots__ = ("id", "name", "address", "pos_x", "pos_y", "last_contact", "stored_at")
+
+    def __init__(self, id, name, address, pos_x=None, pos_y=None, last_contact=None):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.pos_x = pos_x
+        self.pos_y = pos_y
+        self.last_contact = last_contact
+        self.stored_at = last_contact # Timestamp of the current position
+
+class TagStore:
+
+    def __init__(self, flush_interval: float = TAG_FLUSH_INTERVAL_SECONDS, epsilon: float = INGEST_MOVE_EPSILON, heartbeat: float = INGEST_HEARTBEAT_SECONDS):
+        self.flush_interval = flush_interval
+        self.epsilon = epsilon
+        self.heartbeat = timedelta(seconds=heartbeat)
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._by_id = {}
+        self._by_address = {}
+        self._dirty = set()
+        self._touched = set() # last_contact refreshed by suppressed fixes only
+        self._listeners = []
+
+        self._task = None
+
+    #@@@@@ Loading
+    async def load(self):
+        async with database.SessionLocal() as db:
+            tags = (await db.scalars(select(models.Tag))).all()
+
+        with self._lock:
+            self._by_id = {}
+            self._by_address = {}
+            for tag in tags:
+                self._insert(TagEntry(tag.id, tag.name, tag.address, tag.pos_x, tag.pos_y, tag.last_contact))
+            self._dirty.clear()
+            self._loaded = True
+
+    def _insert(self, entry: TagEntry):
+        self._by_id[entry.id] = entry
+        self._by_address[entry.address] = entry
+
+    #@@@@@ Listeners
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, kind: str, entry: TagEntry):
+        for listener in self._listeners:
+            try:
+                listener(kind, entry)
+            except Exception as e:
+                print(f"Tag store listener failed: {e}")
+
+    #@@@@@ Reads
+    def all(self) -> list:
+        return list(self._by_id.values())
+
+    def get(self, tag_id) -> TagEntry | None:
+        return self._by_id.get(tag_id)
+
+    def get_by_address(self, address: str) -> TagEntry | None:
+        return self._by_address.get(address)
+
+    #@@@@@ Writes
+    def update_position(self, address: str, pos_x: float, pos_y: float, timestamp: datetime) -> tuple:
+        # Returns (entry, applied). entry is None when no tag has the address,
+        # applied is False when the tag already holds a newer fix. Raises
+        # ValueError for a non-finite position.
+        # Timestamps ahead of the server clock are clamped to it, or one fix
+        # dated in the future would supersede every later one.
+        timestamp = min(naive_local(timestamp), datetime.now())
+
+        if not (math.isfinite(pos_x) and math.isfinite(pos_y)):
+            raise ValueError("Tag positions must be finite.")
+
+        with self._lock:
+            entry = self._by_address.get(address)
+
+            if entry is None:
+                return None, False
+
+            if entry.last_contact is not None and entry.last_contact > timestamp:
+                return entry, False
+
+            entry.last_contact = timestamp
+
+            if self._suppress(entry, pos_x, pos_y, timestamp):
+                self._touched.add(entry.id)
+                kind = "contact"
+            else:
+                entry.pos_x = pos_x
+                entry.pos_y = pos_y
+                entry.stored_at = timestamp
+                self._dirty.add(entry.id)
+                kind = "position"
+
+        if kind == "position":
+            fixes_accepted.inc()
+        else:
+            fixes_suppressed.inc()
+
+        self._notify(kind, entry)
+
+        return entry, True
+
+    def _suppress(self, entry: TagEntry, pos_x: float, pos_y: float, timestamp: datetime) -> bool:
+        if entry.pos_x is None or entry.pos_y is None or entry.stored_at is None:
+            return False
+
+        if timestamp - entry.stored_at >= self.heartbeat:
+            return False
+
+        return math.hypot(pos_x - entry.pos_x, pos_y - entry.pos_y) < self.epsilon
+
+    def put(self, tag: models.Tag):
+        # Mirror a tag row after it was created or edited through the API
+        with self._lock:
+            entry = self._by_id.get(tag.id)
+
+            if entry is None:
+                entry = TagEntry(tag.id, tag.name, tag.address, tag.pos_x, tag.pos_y, tag.last_contact)
+                self._insert(entry)
+            else:
+                if entry.address != tag.address:
+                    self._by_address.pop(entry.address, None)
+                    entry.address = tag.address
+                    self._by_address[entry.address] = entry
+
+                entry.name = tag.name
+
+        self._notify("put", entry)
+
+    def remove(self, tag_id) -> TagEntry | None:
+        with self._lock:
+            entry = self._by_id.pop(tag_id, None)
+            if entry is not None:
+                self._by_address.pop(entry.address, None)
+            self._dirty.discard(tag_id)
+            self._touched.discard(tag_id)
+
+        if entry is not None:
+            self._notify("remove", entry)
+
+        return entry
+
+    #@@@@@ Write-behind flushing
+    async def flush(self, touched: bool = False) -> int:
+        # touched also writes the last_contact of suppressed fixes
+        with self._lock:
+            if touched:
+                self._dirty.update(self._touched)
+            self._touched.difference_update(self._dirty)
+
+            rows = []
+            for tag_id in self._dirty:
+                entry = self._by_id.get(tag_id)
+                if entry is None:
+                    continue
+                rows.append({
+                    "b_id": entry.id,
+                    "b_pos_x": entry.pos_x,
+                    "b_pos_y": entry.pos_y,
+                    "b_last_contact": entry.last_contact
+                })
+            flushed = set(self._dirty)
+            self._dirty.clear()
+
+        if len(rows) == 0:
+            return 0
+
+        try:
+            rejected = await database.execute_rows(tags_bulk_update, rows)
+        except:
+            # Retry these tags on the next flush
+            with self._lock:
+                self._dirty.update(tag_id for tag_id in flushed if tag_id in self._by_id)
+            raise
+
+        if len(rejected) > 0:
+            flush_rejected.inc(len(rejected))
+            print(f"Tag rows rejected by the database: {', '.join(str(row['b_id']) for row in rejected)}")
+
+        return len(rows) - len(rejected)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Tag store flush failed: {e}")
+
+    async def start(self):
+        if not self._loaded:
+            await self.load()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        # Persist anything written since the last interval, including the
+        # last_contact of suppressed fixes
+        await self.flush(touched=True)
+
+
+store = TagStore()
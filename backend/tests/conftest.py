@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The application modules live in backend/ and are imported by name; the
+# tests use a throwaway SQLite database instead of MariaDB
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AUTONAV_DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "tests.db"))
@@ -0,0 +1,30 @@
+import asyncio
+from fastapi.testclient import TestClient
+import database
+import main
+import metrics
+import migrate
+from routers import auth
+
+async def create_tables():
+    await migrate.upgrade()
+    # The test client runs on its own event loop
+    await database.dispose()
+
+def test_route_labels_include_router_prefix():
+    asyncio.run(create_tables())
+    main.app.dependency_overrides[auth.authenticate_token] = lambda: None
+    main.app.dependency_overrides[auth.authenticate_token_or_device] = lambda: None
+
+    try:
+        client = TestClient(main.app)
+        client.get("/tags/all")
+        client.get("/anchors/all")
+        client.get("/waypoints/all")
+    finally:
+        main.app.dependency_overrides.clear()
+
+    routes = {route for method, route, status in metrics.requests.series if method == "GET"}
+
+    assert {"/tags/all", "/anchors/all", "/waypoints/all"} <= routes
+    assert "/all" not in routes
@@ -0,0 +1,131 @@
+from autonav_secrets import INGEST_UDP_HOST, INGEST_UDP_PORT
+from datetime import datetime
+import asyncio
+import math
+import struct
+import stats
+from tag_store import store
+
+# Binary UDP ingest for robot position reports.
+#
+# Each datagram carries up to 255 fixes and feeds the same tag store update
+# as POST /position. All fields are little-endian:
+#
+#   header  2s magic b"AN", B version (1), B number of records
+#   record  B address length in bytes (1-8), 8s address bytes (zero padded),
+#           I sequence number, d timestamp (seconds since epoch, 0 = now),
+#           d pos_x, d pos_y
+#
+# The address bytes are rendered as upper-case, colon separated hex
+# ("DD:DD:DD:DD:DD:DD"), which must match Tag.address. Sequence numbers are
+# per tag and compared with wrap-around; a fix whose sequence number is not
+# newer than the last accepted one is dropped as a duplicate or out of order.
+# Sequence number 0 restarts the sequence, e.g. after the robot reboots.
+
+MAGIC = b"AN"
+VERSION = 1
+HEADER = struct.Struct("<2sBB")
+RECORD = struct.Struct("<B8sIddd")
+MAX_RECORDS = 255
+
+accepted = stats.counter("udp_ingest_accepted", "UDP fixes applied to the tag store.")
+duplicates = stats.counter("udp_ingest_duplicates", "UDP fixes dropped as duplicate or out of order.")
+unknown = stats.counter("udp_ingest_unknown_tags", "UDP fixes for addresses without a tag.")
+malformed = stats.counter("udp_ingest_malformed", "UDP datagrams dropped as malformed.")
+
+def encode_datagram(fixes: list) -> bytes:
+    # fixes: (address, sequence, timestamp, pos_x, pos_y) tuples
+    if len(fixes) > MAX_RECORDS:
+        raise ValueError(f"At most {MAX_RECORDS} fixes fit in one datagram.")
+
+    parts = [HEADER.pack(MAGIC, VERSION, len(fixes))]
+    for address, sequence, timestamp, pos_x, pos_y in fixes:
+        raw = bytes.fromhex(address.replace(":", ""))
+        parts.append(RECORD.pack(len(raw), raw, sequence, timestamp, pos_x, pos_y))
+
+    return b"".join(parts)
+
+class IngestProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        # Only addresses of known tags are cached, so datagrams with random
+        # addresses cannot grow these without bound
+        self.addresses = {} # raw address bytes -> address text
+        self.sequences = {} # address text -> last accepted sequence number
+
+    def address(self, length: int, raw: bytes) -> str:
+        key = raw[:length]
+        text = self.addresses.get(key)
+
+        if text is None:
+            text = ":".join(f"{b:02X}" for b in key)
+
+            if store.get_by_address(text) is not None:
+                self.addresses[key] = text
+
+        return text
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < HEADER.size:
+            malformed.inc()
+            return
+
+        magic, version, count = HEADER.unpack_from(data)
+
+        if magic != MAGIC or version != VERSION or len(data) != HEADER.size + count * RECORD.size:
+            malformed.inc()
+            return
+
+        received = None
+        sequences = self.sequences
+
+        for length, raw, sequence, timestamp, pos_x, pos_y in RECORD.iter_unpack(memoryview(data)[HEADER.size:]):
+            if length < 1 or length > 8 or not (math.isfinite(pos_x) and math.isfinite(pos_y)):
+                malformed.inc()
+                continue
+
+            address = self.address(length, bytes(raw))
+            last = sequences.get(address)
+
+            # Newer means ahead by less than half the sequence space
+            if last is not None and sequence != 0 and not 0 < (sequence - last) % 0x100000000 < 0x80000000:
+                duplicates.inc()
+                continue
+
+            if timestamp > 0:
+                try:
+                    fixed = datetime.fromtimestamp(timestamp)
+                except (ValueError, OverflowError, OSError):
+                    malformed.inc()
+                    continue
+            else:
+                if received is None:
+                    received = datetime.now()
+                fixed = received
+
+            tag, _ = store.update_position(address, pos_x, pos_y, fixed)
+
+            if tag is None:
+                unknown.inc()
+                continue
+
+            sequences[address] = sequence
+            accepted.inc()
+
+transport = None
+
+async def start():
+    global transport
+
+    if INGEST_UDP_PORT is None or transport is not None:
+        return
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(IngestProtocol, local_addr=(INGEST_UDP_HOST, INGEST_UDP_PORT))
+
+def stop():
+    global transport
+
+    if transport is not None:
+        transport.close()
+        transport = None
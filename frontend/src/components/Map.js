@@ -46,8 +46,23 @@ const Map = (props) => {
             .then(data => setAnchors(data));
 
 
-        // Poll for tags every second
-        const interval = setInterval(() => {
+        // Live tag positions: the server sends the current state of every tag
+        // on connect, then only the tags that changed
+        const streamUrl = new URL('./api/position/stream', window.location.href);
+        streamUrl.protocol = streamUrl.protocol === 'https:' ? 'wss:' : 'ws:';
+        streamUrl.searchParams.set('token', '***TOKEN GOES HERE***');
+
+        const tagsById = {};
+        let socket = null;
+        let retryTimer = null;
+        let retryDelay = 1000;
+        let hasConnected = false;
+        let stopped = false;
+
+        // Tags deleted while disconnected are not in the new stream's
+        // initial state, so the list is checked against /tags/all. Tags the
+        // stream already sent are newer and are kept.
+        const resync = () => {
             fetch('./api/tags/all', {
                 method: 'GET',
                 headers: {
@@ -56,10 +71,54 @@ const Map = (props) => {
                 }
             })
                 .then(res => res.json())
-                .then(data => setTags(data));
-        }, 500);
+                .then(data => {
+                    if (stopped) return;
+                    const ids = new Set(data.map(t => t.id));
+                    Object.keys(tagsById).forEach(id => {
+                        if (!ids.has(id)) delete tagsById[id];
+                    });
+                    data.forEach(t => {
+                        if (!(t.id in tagsById)) tagsById[t.id] = t;
+                    });
+                    setTags(Object.values(tagsById));
+                })
+                .catch(() => {});
+        };
+
+        const connect = () => {
+            socket = new WebSocket(streamUrl);
+            socket.onopen = () => {
+                if (hasConnected) resync();
+                hasConnected = true;
+                retryDelay = 1000;
+            };
+            socket.onmessage = (event) => {
+                JSON.parse(event.data).forEach(t => {
+                    if (t.deleted) {
+                        delete tagsById[t.id];
+                    } else {
+                        tagsById[t.id] = t;
+                    }
+                });
+                setTags(Object.values(tagsById));
+            };
+            socket.onerror = () => socket.close();
+            // Reconnect after server restarts and network drops, backing off
+            // up to 30 s
+            socket.onclose = () => {
+                if (stopped) return;
+                retryTimer = setTimeout(connect, retryDelay);
+                retryDelay = Math.min(retryDelay * 2, 30000);
+            };
+        };
 
-        return () => clearInterval(interval);
+        connect();
+
+        return () => {
+            stopped = true;
+            clearTimeout(retryTimer);
+            socket.close();
+        };
     }, []);
 
     const scaleX = stageSize.width / nativeWidth;
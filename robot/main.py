@@ -125,12 +125,12 @@ def uwb_calculate_coordinates():
     # send request
     url = API_BASE + "/position"
     data = {
-        "address": "DD:DD:DD:DD:DD:DD",
+        "address": TAG_ADDRESS,
         "pos_x": xpos,
         "pos_y": ypos
     }
 
-    _ = requests.post(url, json=data)
+    _ = requests.post(url, json=data, headers={"Authorization": f"Bearer {DEVICE_TOKEN}"})
 
 
 # Callback Functions
@@ -168,7 +168,7 @@ def init_uwb():
     json_response = None
     while True:
         req = requests.get(API_ANCHORS_ALL, 
-                        headers={"Content-Type":"application/json", "Authorization": f"Bearer {API_ACCESS_TOKEN}"})
+                        headers={"Content-Type":"application/json", "Authorization": f"Bearer {DEVICE_TOKEN}"})
         
         if req.status_code == 200:
             try: